@@ -0,0 +1,155 @@
+import threading
+import time
+
+from tracing import span
+
+# PortAudio constants, so the engine can be built (and fed by a synthetic
+# source) without importing PyAudio; pyaudio itself is imported by start()
+SAMPLE_SIZES = {1: 4, 2: 4, 4: 3, 8: 2, 16: 1, 32: 1}  # paFloat32, paInt32, paInt24, paInt16, paInt8, paUInt8
+PA_CONTINUE = 0
+PA_INPUT_OVERFLOW = 0x2
+
+
+# Fixed-size byte ring shared between the PyAudio callback (producer) and the
+# drain thread (consumer). Storage is allocated once; bookkeeping is O(1).
+class RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._read_pos = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self.data_ready = threading.Condition(self._lock)
+
+    def __len__(self):
+        return self._size
+
+    def write(self, data):
+        # Returns False without writing anything if the chunk does not fit
+        n = len(data)
+        with self._lock:
+            if n > self.capacity - self._size:
+                return False
+            start = (self._read_pos + self._size) % self.capacity
+            first = min(n, self.capacity - start)
+            self._view[start:start + first] = data[:first]
+            if first < n:
+                self._view[:n - first] = data[first:]
+            self._size += n
+            self.data_ready.notify()
+            return True
+
+    def read(self, max_bytes=None, timeout=None):
+        with self._lock:
+            if not self._size and timeout is not None:
+                self.data_ready.wait(timeout)
+            n = self._size if max_bytes is None else min(max_bytes, self._size)
+            start = self._read_pos
+            first = min(n, self.capacity - start)
+            data = bytes(self._view[start:start + first])
+            if first < n:
+                data += bytes(self._view[:n - first])
+            self._read_pos = (start + n) % self.capacity
+            self._size -= n
+            return data
+
+
+# Real-time capture built on PyAudio's non-blocking callback mode. The callback
+# only copies into the ring buffer; a consumer thread drains it and hands the
+# PCM to every registered consumer (WAV sink, streamer, encoder...).
+class AudioCaptureEngine:
+    def __init__(self, format, channels, rate, chunk, device_index=None, buffer_seconds=10, pyaudio_instance=None):
+        self.format = format
+        self.channels = channels
+        self.rate = rate
+        self.chunk = chunk
+        self.device_index = device_index
+        self.sample_width = SAMPLE_SIZES[format]
+        self.frame_bytes = self.sample_width * channels
+        self.ring = RingBuffer(int(rate * buffer_seconds) * self.frame_bytes)
+        self.consumers = []
+        self.frames_captured = 0
+        self.overruns = 0
+        self.dropped_frames = 0
+        # time.monotonic() of the newest chunk in the ring, and of the chunk being handed to consumers
+        self.last_write_time = None
+        self.read_time = None
+        # A shared PyAudio instance (one per process) is used but never terminated here
+        self._shared_pyaudio = pyaudio_instance
+        self._pyaudio = None
+        self._stream = None
+        self._drain_thread = None
+        self._running = False
+
+    def add_consumer(self, consumer):
+        self.consumers.append(consumer)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if status & PA_INPUT_OVERFLOW:
+            self.overruns += 1
+        if self.ring.write(in_data):
+            self.frames_captured += frame_count
+            self.last_write_time = time.monotonic()
+        else:
+            self.dropped_frames += frame_count
+        return (None, PA_CONTINUE)
+
+    def _drain(self):
+        while self._running or len(self.ring):
+            data = self.ring.read(timeout=0.1)
+            if not data:
+                continue
+            self.read_time = self.last_write_time
+            for consumer in self.consumers:
+                try:
+                    with span("audio_consumer", consumer=getattr(consumer, '__qualname__', None), size=len(data)):
+                        consumer(data)
+                except Exception as e:
+                    print(f"Audio consumer {consumer} failed: {e}")
+
+    def start(self):
+        if self._shared_pyaudio is not None:
+            self._pyaudio = self._shared_pyaudio
+        else:
+            import pyaudio
+            self._pyaudio = pyaudio.PyAudio()
+        try:
+            self._stream = self._pyaudio.open(format=self.format, channels=self.channels, rate=self.rate,
+                                              input=True, frames_per_buffer=self.chunk,
+                                              input_device_index=self.device_index,
+                                              stream_callback=self._callback)
+        except IOError:
+            if self._pyaudio is not self._shared_pyaudio:
+                self._pyaudio.terminate()
+            self._pyaudio = None
+            raise
+        self._running = True
+        self._drain_thread = threading.Thread(target=self._drain, name="audio-drain", daemon=True)
+        self._drain_thread.start()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._pyaudio is not None:
+            if self._pyaudio is not self._shared_pyaudio:
+                self._pyaudio.terminate()
+            self._pyaudio = None
+        self._running = False
+        if self._drain_thread is not None:
+            self._drain_thread.join()
+            self._drain_thread = None
+
+    @property
+    def duration(self):
+        return self.frames_captured / self.rate
+
+    def stats(self):
+        return {
+            'frames_captured': self.frames_captured,
+            'overruns': self.overruns,
+            'dropped_frames': self.dropped_frames,
+            'buffered_bytes': len(self.ring),
+        }
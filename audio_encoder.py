@@ -0,0 +1,144 @@
+import queue
+import shutil
+import subprocess
+import threading
+
+try:
+    import soundfile
+except ImportError:  # Only needed for FLAC
+    soundfile = None
+
+AUDIO_MIME_TYPES = {
+    '.wav': 'audio/wav',
+    '.flac': 'audio/flac',
+    '.opus': 'audio/ogg',
+}
+
+
+# Encoders sit between the capture engine and the uploader. feed() only queues
+# the PCM chunk; a background thread does the actual encoding so the capture
+# drain thread is never held up by the codec.
+class AudioEncoder:
+    extension = None
+
+    def __init__(self, base_path, rate, channels, sample_width, max_queue_chunks=1024):
+        self.path = base_path + self.extension
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.bytes_in = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queue_chunks)
+        self._thread = threading.Thread(target=self._run, name=f"audio-encode{self.extension}", daemon=True)
+        self._open()
+        self._thread.start()
+
+    @property
+    def mime_type(self):
+        return AUDIO_MIME_TYPES[self.extension]
+
+    @property
+    def pending_chunks(self):
+        return self._queue.qsize()
+
+    def feed(self, data):
+        if self.error is not None:
+            return
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            # The codec has stalled; a file with a gap is useless, so the upload falls back to the WAV
+            self.error = RuntimeError(f"encoder fell more than {self._queue.maxsize} chunks behind")
+            print(f"Audio encoder {self.path} failed: {self.error}")
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self._encode(data)
+                self.bytes_in += len(data)
+            except Exception as e:
+                self.error = e
+                print(f"Audio encoder {self.path} failed: {e}")
+        try:
+            self._finish()
+        except Exception as e:
+            self.error = self.error or e
+
+    def close(self):
+        # Returns True if the encoded file is complete and usable
+        self._queue.put(None)
+        self._thread.join()
+        return self.error is None
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _encode(self, data):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+class FlacEncoder(AudioEncoder):
+    extension = '.flac'
+
+    def _open(self):
+        if soundfile is None:
+            raise RuntimeError("FLAC encoding requires the soundfile package (pip install soundfile)")
+        if self.sample_width != 2:
+            raise ValueError("FLAC encoder expects 16-bit PCM input")
+        self._file = soundfile.SoundFile(self.path, 'w', samplerate=self.rate, channels=self.channels,
+                                         format='FLAC', subtype='PCM_16')
+
+    def _encode(self, data):
+        self._file.buffer_write(data, dtype='int16')
+
+    def _finish(self):
+        self._file.close()
+
+
+class OpusEncoder(AudioEncoder):
+    extension = '.opus'
+    bitrate_kbps = 24  # Plenty for speech
+
+    def _open(self):
+        opusenc = shutil.which('opusenc')
+        if opusenc is None:
+            raise RuntimeError("Opus encoding requires opusenc from opus-tools on the PATH")
+        # opusenc resamples internally, so any capture rate works
+        self._process = subprocess.Popen(
+            [opusenc, '--quiet', '--speech', '--bitrate', str(self.bitrate_kbps),
+             '--raw', '--raw-bits', str(self.sample_width * 8), '--raw-rate', str(self.rate),
+             '--raw-chan', str(self.channels), '-', self.path],
+            stdin=subprocess.PIPE)
+
+    def _encode(self, data):
+        self._process.stdin.write(data)
+
+    def _finish(self):
+        self._process.stdin.close()
+        if self._process.wait() != 0:
+            raise RuntimeError(f"opusenc exited with status {self._process.returncode}")
+
+
+ENCODERS = {
+    'flac': FlacEncoder,
+    'opus': OpusEncoder,
+}
+
+
+def create_encoder(codec, base_path, rate, channels, sample_width):
+    # 'wav' (or no codec) means upload the WAV sink's file as-is
+    if not codec or codec == 'wav':
+        return None
+    try:
+        encoder_class = ENCODERS[codec]
+    except KeyError:
+        raise ValueError(f"Unknown audio codec {codec!r}; expected one of wav, {', '.join(ENCODERS)}")
+    return encoder_class(base_path, rate, channels, sample_width)
@@ -0,0 +1,159 @@
+import http.client
+import json
+import queue
+import threading
+import time
+from collections import deque
+from urllib.parse import urlencode, urlsplit
+
+
+# Streams raw PCM to the transcription server while recording, as one long
+# chunked-transfer POST per connection. Registered as an AudioCaptureEngine
+# consumer. Bytes written to the socket are not yet on the server, so the last
+# `replay_seconds` of sent audio are kept; after a dropped connection the
+# client asks the server how many bytes it holds and resends from there. If
+# chunks had to be dropped, or the server is missing bytes that are no longer
+# retained, the stream is marked incomplete so the caller can fall back to
+# uploading the full file.
+class AudioStreamer:
+    def __init__(self, server_url, session_id, rate, channels, sample_width, extra_params=None,
+                 path="/stream/audio", max_queue_chunks=512, reconnect_attempts=5, timeout=30, replay_seconds=60):
+        parts = urlsplit(server_url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.base_path = parts.path.rstrip('/') + path
+        self.params = {'session_id': session_id, 'rate': rate, 'channels': channels,
+                       'sample_width': sample_width}
+        self.params.update(extra_params or {})
+        self.timeout = timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.max_replay_bytes = int(replay_seconds * rate) * channels * sample_width
+        self.bytes_sent = 0
+        self.dropped_chunks = 0
+        self.complete = False
+        self.response = None
+        self._queue = queue.Queue(maxsize=max_queue_chunks)
+        self._replay = deque()  # (stream offset, chunk) of the most recently sent audio
+        self._replay_bytes = 0
+        self._replay_start = 0  # Oldest offset that can still be resent
+        self._eof = False
+        self._closing = False
+        self._thread = None
+
+    @property
+    def pending_chunks(self):
+        return self._queue.qsize()
+
+    def feed(self, data):
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            # The server is not keeping up; the full file upload has to cover the gap
+            self.dropped_chunks += 1
+
+    def _connection(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _retain(self, chunk):
+        self._replay.append((self.bytes_sent, chunk))
+        self._replay_bytes += len(chunk)
+        while self._replay_bytes > self.max_replay_bytes and len(self._replay) > 1:
+            _, oldest = self._replay.popleft()
+            self._replay_bytes -= len(oldest)
+            self._replay_start += len(oldest)
+
+    def _body(self, offset):
+        # Resends retained audio from `offset`, then continues with live chunks
+        for chunk_offset, chunk in list(self._replay):
+            if chunk_offset + len(chunk) > offset:
+                yield chunk[max(0, offset - chunk_offset):]
+        while not self._eof:
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+                return
+            # Retained before it is written, so a send that fails halfway can be replayed
+            self._retain(chunk)
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    def _server_offset(self):
+        # How many bytes of this session's stream the server holds
+        conn = self._connection()
+        try:
+            conn.request('GET', f"{self.base_path}?{urlencode({'session_id': self.params['session_id']})}")
+            response = conn.getresponse()
+            body = response.read()
+            if response.status >= 400:
+                raise http.client.HTTPException(f"server responded {response.status}: {body[:200]!r}")
+            return int(json.loads(body)['received_bytes'])
+        finally:
+            conn.close()
+
+    def _run(self):
+        attempts = 0
+        reconnecting = False
+        while True:
+            conn = self._connection()
+            sent_before = self.bytes_sent
+            try:
+                offset = self._server_offset() if reconnecting else 0
+                if not self._replay_start <= offset <= self.bytes_sent:
+                    print(f"Server holds {offset} bytes of the stream but only bytes {self._replay_start}-"
+                          f"{self.bytes_sent} can be resent. Giving up on live streaming.")
+                    self._discard()
+                    return
+                path = f"{self.base_path}?{urlencode({**self.params, 'offset': offset})}"
+                print(f"Streaming audio to {self.scheme}://{self.host}{self.base_path} from offset {offset}")
+                conn.request('POST', path, body=self._body(offset), encode_chunked=True,
+                             headers={'Content-Type': 'application/octet-stream'})
+                response = conn.getresponse()
+                body = response.read()
+                if response.status >= 400:
+                    raise http.client.HTTPException(f"server responded {response.status}: {body[:200]!r}")
+                try:
+                    self.response = json.loads(body)
+                except ValueError:
+                    self.response = body.decode(errors='replace')
+                received = self.response.get('received_bytes') if isinstance(self.response, dict) else None
+                # Complete only if the server confirms every byte; anything else falls back to the file upload
+                self.complete = self.dropped_chunks == 0 and received == self.bytes_sent
+                print(f"Audio stream finished. Sent {self.bytes_sent} bytes. Server response: {response.status}")
+                return
+            except (OSError, ValueError, KeyError, http.client.HTTPException) as e:
+                if self.bytes_sent > sent_before:
+                    # This connection got past the resent audio and carried new chunks, so it
+                    # counts as a successful reconnect; only consecutive failures use up attempts
+                    attempts = 0
+                attempts += 1
+                reconnecting = True
+                print(f"Audio stream interrupted: {e}")
+                if attempts > self.reconnect_attempts:
+                    print("Max stream reconnects reached. Giving up on live streaming.")
+                    self._discard()
+                    return
+                time.sleep(min(2 ** attempts, 30))
+            finally:
+                conn.close()
+
+    def _discard(self):
+        # Keep draining so feed() never blocks the capture engine after a failure
+        while not self._eof:
+            if self._queue.get() is None:
+                self._eof = True
+            else:
+                self.dropped_chunks += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="audio-stream", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=None):
+        if self._closing:
+            return
+        self._closing = True
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,410 @@
+import argparse
+import functools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from metrics import METRICS
+
+# Offline benchmark for the recording pipeline. The bot recorder's
+# SessionManager runs unchanged, but PyAudio is replaced by a synthetic PCM
+# source, mss by generated frames, and the server by local_server.py in a
+# child process with injectable latency and failures. Time is compressed by
+# --speed: audio is produced that many times faster than real time and the
+# screenshot interval is divided by it, so `--hours 2 --speed 60` simulates a
+# two-hour session in two minutes. Reports throughput, memory growth per
+# simulated hour, CPU per pipeline stage and upload bytes; --json saves the
+# results and --baseline fails the run when a saved result regresses.
+#
+# The pipeline switches (BATCH_SCREENSHOTS, SCREENSHOT_DELTA, AUDIO_CODEC,
+# VAD...) are read from the environment as usual.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Thread name prefix -> pipeline stage for the CPU breakdown
+STAGES = (
+    ('synthetic-audio', 'audio source'),
+    ('audio-drain', 'audio processing'),
+    ('screen-capture', 'capture'),
+    ('capture-complete', 'encode wait and queueing'),
+    ('image-encode', 'encode'),
+    ('image-upload', 'image upload'),
+    ('delta-upload', 'image upload'),
+    ('upload-part', 'audio upload'),
+    ('stop-', 'audio upload'),
+    ('MainThread', 'main'),
+)
+
+# Result keys compared against a baseline, where larger is worse
+REGRESSION_KEYS = ('cpu_seconds_per_hour', 'rss_growth_mb_per_hour', 'upload_mb_per_hour', 'audio_loss_ratio')
+
+
+class SyntheticAudioStream:
+    def __init__(self, callback, rate, channels, chunk, speed, seed):
+        self.callback = callback
+        self.chunk = chunk
+        self.chunk_seconds = chunk / rate / speed
+        self.frame_bytes = 2 * channels
+        self.pcm = synthetic_speech(rate, channels, seed)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="synthetic-audio", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # Paced against a fixed schedule; a late chunk is delivered at once, like a device catching up
+        offset, delivered, started = 0, 0, time.monotonic()
+        size = self.chunk * self.frame_bytes
+        while self._running:
+            delay = started + delivered * self.chunk_seconds - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if offset + size > len(self.pcm):
+                offset = 0
+            self.callback(self.pcm[offset:offset + size], self.chunk, {}, 0)
+            offset += size
+            delivered += 1
+
+    def stop_stream(self):
+        self._running = False
+        self._thread.join()
+
+    def close(self):
+        pass
+
+
+# Stands in for pyaudio.PyAudio: opening an input stream starts a thread that
+# feeds the capture callback with generated 16-bit PCM.
+class SyntheticPyAudio:
+    def __init__(self, speed=1.0, seed=0):
+        self.speed = speed
+        self.seed = seed
+
+    def open(self, format, channels, rate, input=True, frames_per_buffer=1024, input_device_index=None,
+             stream_callback=None):
+        if format != 8:  # pyaudio.paInt16
+            raise IOError("The synthetic audio source only produces 16-bit PCM")
+        return SyntheticAudioStream(stream_callback, rate, channels, frames_per_buffer, self.speed, self.seed)
+
+    def terminate(self):
+        pass
+
+
+def synthetic_speech(rate, channels, seed, seconds=10):
+    # Harmonic "voice" in syllable-rate bursts with pauses, over low noise, so VAD and AGC have work to do
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(rate * seconds)) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    talking = (np.sin(2 * np.pi * 0.15 * t) > -0.3).astype(np.float64)
+    signal = 0.3 * voice * syllables * talking + 0.005 * rng.standard_normal(len(t))
+    samples = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    return np.repeat(samples[:, None], channels, axis=1).tobytes()
+
+
+class SyntheticScreenShot:
+    def __init__(self, raw, width, height):
+        self.raw = raw
+        self.width = width
+        self.height = height
+        self.size = (width, height)
+
+
+# Stands in for an mss handle. Each monitor starts as a desktop-like picture
+# (gradient, window blocks, text-like stripes); on every grab, with probability
+# `change_rate`, a random window-sized region is repainted. Every grab returns
+# a fresh buffer, as mss does.
+class SyntheticScreen:
+    def __init__(self, width=1920, height=1080, monitors=1, change_rate=0.3, change_area=0.05, seed=0):
+        self.width = width
+        self.height = height
+        self.change_rate = change_rate
+        self.change_area = change_area
+        self._rng = np.random.default_rng(seed)
+        self.monitors = [{'left': 0, 'top': 0, 'width': width * monitors, 'height': height}]
+        self.monitors += [{'left': width * i, 'top': 0, 'width': width, 'height': height, 'index': i}
+                          for i in range(monitors)]
+        self._pixels = [self._desktop() for _ in range(monitors)]
+
+    def _desktop(self):
+        y, x = np.mgrid[0:self.height, 0:self.width]
+        pixels = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        pixels[..., 0] = 120 + (x * 60 // self.width)
+        pixels[..., 1] = 80 + (y * 60 // self.height)
+        pixels[..., 2] = 60
+        pixels[..., 3] = 255
+        for _ in range(6):
+            self._repaint(pixels, 0.15)
+        return pixels
+
+    def _repaint(self, pixels, area):
+        h = max(8, int(self.height * area ** 0.5))
+        w = max(8, int(self.width * area ** 0.5))
+        top = int(self._rng.integers(0, self.height - h + 1))
+        left = int(self._rng.integers(0, self.width - w + 1))
+        region = pixels[top:top + h, left:left + w]
+        region[..., :3] = self._rng.integers(180, 256, 3, dtype=np.uint8)
+        # Lines of "text": short dark runs every few rows
+        rows = region[4::12]
+        rows[:, self._rng.random(w) < 0.5, :3] = self._rng.integers(0, 80, dtype=np.uint8)
+
+    def grab(self, monitor):
+        pixels = self._pixels[monitor['index']]
+        if self._rng.random() < self.change_rate:
+            self._repaint(pixels, self.change_area)
+        return SyntheticScreenShot(bytearray(pixels.tobytes()), self.width, self.height)
+
+    def close(self):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stand_in(root, latency, latency_jitter, failure_rate):
+    # In a child process so the server's CPU and memory are not counted against the client
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPT_DIR, "local_server.py"), '--port', str(port), '--root', root,
+         '--latency', str(latency), '--latency-jitter', str(latency_jitter), '--failure-rate', str(failure_rate),
+         '--quiet'], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("Stand-in server did not start")
+            time.sleep(0.1)
+
+
+def stage_of(thread_name):
+    for prefix, stage in STAGES:
+        if thread_name.startswith(prefix):
+            return stage
+    return 'other'
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, not current, off Linux
+
+
+# Samples resident memory and per-thread CPU time (from /proc on Linux) once
+# per `interval`. Threads are tracked by native id, so a thread's last sample
+# still counts after it exits.
+class ResourceSampler:
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.samples = []  # (seconds since start, rss bytes)
+        self.thread_cpu = {}  # native id -> (name, cpu seconds)
+        self._clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self._started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="benchmark-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _sample(self):
+        self.samples.append((time.monotonic() - self._started, rss_bytes()))
+        names = {thread.native_id: thread.name for thread in threading.enumerate()}
+        try:
+            tasks = os.listdir("/proc/self/task")
+        except OSError:
+            return
+        for task in tasks:
+            try:
+                with open(f"/proc/self/task/{task}/stat") as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue  # Exited since listdir
+            tid = int(task)
+            if tid == threading.get_native_id():
+                continue
+            name = names.get(tid) or self.thread_cpu.get(tid, ("native",))[0]
+            self.thread_cpu[tid] = (name, (int(fields[11]) + int(fields[12])) / self._clock_ticks)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def cpu_by_stage(self):
+        stages = {}
+        for name, seconds in self.thread_cpu.values():
+            stage = stage_of(name)
+            stages[stage] = stages.get(stage, 0.0) + seconds
+        return stages
+
+    def rss_growth_per_second(self, warm_up=0.1):
+        # Least-squares slope of RSS over time, ignoring the first `warm_up` fraction of the run
+        samples = self.samples[int(len(self.samples) * warm_up):]
+        if len(samples) < 2:
+            return 0.0
+        t, rss = np.array(samples, dtype=np.float64).T
+        return float(np.polyfit(t, rss, 1)[0])
+
+
+def metric_total(snapshot, name, field='value'):
+    return sum(sample[field] for sample in snapshot.get(name, []))
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="recorder-benchmark-")
+    server, url = start_stand_in(os.path.join(workdir, "server"), args.latency, args.latency_jitter,
+                                 args.failure_rate)
+    os.environ['SERVER_URL'] = url
+    os.chdir(workdir)  # Session folders are created in the working directory
+    sys.path.insert(0, SCRIPT_DIR)
+    import recordsdatasendstoazurevm as recorder
+
+    recorder.SCREENSHOT_INTERVAL = args.interval / args.speed
+    width, height = map(int, args.resolution.lower().split('x'))
+    screen = functools.partial(SyntheticScreen, width, height, args.monitors, args.change_rate,
+                               args.change_area, args.seed)
+    simulated_seconds = args.hours * 3600
+    wall_seconds = simulated_seconds / args.speed
+
+    log = sys.stdout if args.verbose else open(os.devnull, 'w')
+    real_stdout, sys.stdout = sys.stdout, log
+    sampler = ResourceSampler(args.sample_interval)
+    try:
+        started, cpu_started = time.monotonic(), time.process_time()
+        sampler.start()
+        manager = recorder.SessionManager(screen_source=screen,
+                                          pyaudio_instance=SyntheticPyAudio(args.speed, args.seed))
+        sessions = [manager.start_session(list(range(args.monitors)), 2, "benchmark", session_id=f"benchmark_{i}")
+                    for i in range(args.sessions)]
+        time.sleep(wall_seconds)
+        capture_done = time.monotonic()
+        manager.close()
+        finished = time.monotonic()
+        sampler.stop()
+        cpu_seconds = time.process_time() - cpu_started
+    finally:
+        sys.stdout = real_stdout
+        server.terminate()
+        server.wait()
+        os.chdir(SCRIPT_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    snapshot = METRICS.snapshot()
+    hours = args.hours * args.sessions
+    audio_seconds = metric_total(snapshot, 'audio_frames_captured_total') / recorder.RATE
+    audio_lost = metric_total(snapshot, 'audio_dropped_frames_total') / recorder.RATE
+    requests = metric_total(snapshot, 'http_request_seconds', 'count')
+    upload_bytes = metric_total(snapshot, 'upload_bytes_total')
+    results = {
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('json', 'baseline', 'tolerance', 'keep', 'verbose')},
+        'wall_seconds': round(finished - started, 2),
+        'drain_seconds': round(finished - capture_done, 2),
+        'audio_realtime_factor': round(audio_seconds / (capture_done - started), 2),
+        'audio_loss_ratio': round(audio_lost / audio_seconds, 6) if audio_seconds else 0.0,
+        'screenshot_ticks': sum(session.screenshot_count for session in sessions),
+        'screenshot_ticks_expected': int(simulated_seconds / args.interval) * args.sessions,
+        'screenshots_unchanged': metric_total(snapshot, 'screenshots_unchanged_total'),
+        'capture_missed_ticks': metric_total(snapshot, 'capture_missed_ticks_total'),
+        'uploads_dropped': metric_total(snapshot, 'upload_queue_dropped_total'),
+        'http_requests': requests,
+        'http_mean_ms': round(sum(s['count'] * s['mean'] for s in snapshot.get('http_request_seconds', []))
+                              / requests * 1000, 1) if requests else 0.0,
+        'http_retries': metric_total(snapshot, 'http_retries_total'),
+        'http_failures': metric_total(snapshot, 'http_failures_total'),
+        'upload_bytes': upload_bytes,
+        'upload_mb_per_hour': round(upload_bytes / 1e6 / hours, 2),
+        'rss_start_mb': round(sampler.samples[0][1] / 1e6, 1) if sampler.samples else None,
+        'rss_end_mb': round(sampler.samples[-1][1] / 1e6, 1) if sampler.samples else None,
+        # RSS slope per wall second, scaled to a simulated hour
+        'rss_growth_mb_per_hour': round(sampler.rss_growth_per_second() * 3600 / args.speed / 1e6, 2),
+        'cpu_seconds': round(cpu_seconds, 2),
+        'cpu_seconds_per_hour': round(cpu_seconds / hours, 2),
+        'cpu_by_stage': {stage: round(seconds, 2) for stage, seconds in sorted(sampler.cpu_by_stage().items())},
+    }
+    if args.keep:
+        results['workdir'] = workdir
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Keys that got worse by more than `tolerance` (a fraction) against the baseline
+    regressions = []
+    for key in REGRESSION_KEYS:
+        before, after = baseline.get(key), results.get(key)
+        if before is None or after is None:
+            continue
+        if after > before * (1 + tolerance) + 1e-9 and after - before > 0.01:
+            regressions.append(f"{key}: {before} -> {after}")
+    return regressions
+
+
+def print_report(results):
+    for key, value in results.items():
+        if key in ('config', 'cpu_by_stage'):
+            continue
+        print(f"{key:>28}: {value}")
+    print(f"{'cpu_by_stage':>28}:")
+    wall = results['wall_seconds']
+    for stage, seconds in sorted(results['cpu_by_stage'].items(), key=lambda item: -item[1]):
+        print(f"{stage:>28}: {seconds:8.2f}s  {seconds / wall:6.1%} of one core")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the recording pipeline")
+    parser.add_argument("--hours", type=float, default=1.0, help="simulated session length")
+    parser.add_argument("--speed", type=float, default=60.0, help="simulated seconds per wall-clock second")
+    parser.add_argument("--sessions", type=int, default=1, help="concurrent recording sessions")
+    parser.add_argument("--monitors", type=int, default=1)
+    parser.add_argument("--resolution", default="1920x1080")
+    parser.add_argument("--interval", type=float, default=10.0, help="simulated seconds between screenshots")
+    parser.add_argument("--change-rate", type=float, default=0.3, help="fraction of grabs that change the screen")
+    parser.add_argument("--change-area", type=float, default=0.05, help="fraction of the screen a change repaints")
+    parser.add_argument("--latency", type=float, default=0.05, help="stand-in server latency, seconds")
+    parser.add_argument("--latency-jitter", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests failed with 503")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between memory/CPU samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="write the results here")
+    parser.add_argument("--baseline", metavar="PATH", help="exit non-zero if results regress against this file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the session folders and received uploads")
+    parser.add_argument("--verbose", action="store_true", help="show the recorder's own output")
+    args = parser.parse_args()
+    args.json = args.json and os.path.abspath(args.json)
+    args.baseline = args.baseline and os.path.abspath(args.baseline)
+
+    results = run(args)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
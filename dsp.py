@@ -0,0 +1,122 @@
+from math import gcd
+
+import numpy as np
+
+
+# Streaming polyphase resampler by the rational factor up/down. Each call to
+# process() only keeps the last `taps_per_phase` input samples as history, so
+# memory is bounded regardless of how long the session runs.
+class PolyphaseResampler:
+    def __init__(self, in_rate, out_rate, taps_per_phase=32, kaiser_beta=6.0):
+        divisor = gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.taps = taps_per_phase
+        # Low-pass prototype at the upsampled rate, cut off at the lower Nyquist
+        length = self.up * taps_per_phase
+        cutoff = 1.0 / max(self.up, self.down)
+        n = np.arange(length) - (length - 1) / 2
+        prototype = cutoff * np.sinc(cutoff * n) * np.kaiser(length, kaiser_beta) * self.up
+        # phases[p, j] multiplies input sample i - j for output phase p
+        self.phases = prototype.reshape(taps_per_phase, self.up).T.astype(np.float32)
+        self._history = np.zeros(taps_per_phase - 1, dtype=np.float32)
+        self._base = -(taps_per_phase - 1)  # Global input index of _history[0]
+        self._next_out = 0
+
+    def process(self, samples):
+        buffer = np.concatenate([self._history, samples.astype(np.float32, copy=False)])
+        end = self._base + len(buffer)  # One past the last available input index
+        last_out = (end * self.up - 1) // self.down
+        if last_out < self._next_out:
+            self._history = buffer
+            return np.zeros(0, dtype=np.float32)
+        positions = np.arange(self._next_out, last_out + 1, dtype=np.int64) * self.down
+        inputs = positions // self.up - self._base
+        window = inputs[:, None] - np.arange(self.taps)[None, :]
+        out = np.einsum('ij,ij->i', self.phases[positions % self.up], buffer[window])
+        self._next_out = last_out + 1
+        # Keep just enough history for the next output's filter window
+        keep_from = (self._next_out * self.down) // self.up - self._base - (self.taps - 1)
+        self._history = buffer[keep_from:]
+        self._base += keep_from
+        return out
+
+    def flush(self):
+        # Push the filter's group delay through with trailing silence
+        return self.process(np.zeros(self.taps // 2, dtype=np.float32))
+
+
+# Smoothed automatic gain: moves the block RMS towards target_rms and ramps
+# gain changes across each block. While the smoothed RMS is below noise_floor
+# (-40 dBFS by default, the level of a quiet room rather than of speech) nothing
+# is boosted: the gain is released towards 1.0 by `release` per block, so the
+# pauses between utterances are left at their recorded level.
+class GainNormalizer:
+    def __init__(self, target_rms=0.1, max_gain=10.0, noise_floor=1e-2, smoothing=0.9, release=0.8):
+        self.target_rms = target_rms
+        self.max_gain = max_gain
+        self.noise_floor = noise_floor
+        self.smoothing = smoothing
+        self.release = release
+        self.gain = 1.0
+        self._rms = None
+
+    def process(self, samples):
+        if not len(samples):
+            return samples
+        rms = float(np.sqrt(np.mean(np.square(samples))))
+        self._rms = rms if self._rms is None else self.smoothing * self._rms + (1 - self.smoothing) * rms
+        if self._rms > self.noise_floor:
+            target_gain = min(self.target_rms / self._rms, self.max_gain)
+        else:
+            target_gain = 1.0 + (self.gain - 1.0) * self.release
+        ramp = np.linspace(self.gain, target_gain, len(samples), dtype=np.float32)
+        self.gain = target_gain
+        return np.clip(samples * ramp, -1.0, 1.0)
+
+
+# Block-streaming preprocessing between the capture engine and its consumers:
+# int16 PCM in, downmixed / resampled / normalized int16 PCM out.
+class AudioPreprocessor:
+    def __init__(self, in_rate, in_channels, target_rate=16000, normalize=True):
+        self.in_rate = in_rate
+        self.in_channels = in_channels
+        self.rate = target_rate or in_rate
+        self.channels = 1
+        self.sample_width = 2
+        self.resampler = PolyphaseResampler(in_rate, self.rate) if self.rate != in_rate else None
+        self.normalizer = GainNormalizer() if normalize else None
+        self.consumers = []
+        self._remainder = b''
+
+    def add_consumer(self, consumer):
+        self.consumers.append(consumer)
+
+    def process(self, data):
+        frame_bytes = 2 * self.in_channels
+        data = self._remainder + data
+        usable = len(data) - len(data) % frame_bytes
+        self._remainder = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768.0
+        if self.in_channels > 1:
+            samples = samples.reshape(-1, self.in_channels).mean(axis=1)
+        if self.resampler:
+            samples = self.resampler.process(samples)
+        return self._to_pcm(samples)
+
+    def _to_pcm(self, samples):
+        if self.normalizer:
+            samples = self.normalizer.process(samples)
+        return (np.clip(samples, -1.0, 32767 / 32768) * 32768).astype('<i2').tobytes()
+
+    def _emit(self, out):
+        if out:
+            for consumer in self.consumers:
+                consumer(out)
+
+    def feed(self, data):
+        self._emit(self.process(data))
+
+    def flush(self):
+        if self.resampler:
+            self._emit(self._to_pcm(self.resampler.flush()))
@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+
+
+def bgra_view(screenshot):
+    # (height, width, 4) uint8 view over mss's raw buffer; no copy
+    return np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(screenshot.height, screenshot.width, 4)
+
+
+def luma_thumbnail(bgra, grid=(36, 64)):
+    # Strided subsample, then block-average into a grid x grid luma thumbnail
+    rows, cols = grid
+    height, width = bgra.shape[:2]
+    step = max(1, min(height // (rows * 4), width // (cols * 4)))
+    sampled = bgra[::step, ::step]
+    block_h, block_w = sampled.shape[0] // rows, sampled.shape[1] // cols
+    sampled = sampled[:block_h * rows, :block_w * cols].astype(np.float32)
+    luma = sampled[..., 0] * 0.114 + sampled[..., 1] * 0.587 + sampled[..., 2] * 0.299
+    return luma.reshape(rows, block_h, cols, block_w).mean(axis=(1, 3))
+
+
+# Decides per monitor whether a grab differs enough from the last uploaded one
+# to be worth encoding and sending. A change in any single grid cell counts, so
+# small edits (slide numbers, a chat line) are still caught; a frame is also
+# forced through every `keyframe_interval` seconds.
+class ChangeDetector:
+    def __init__(self, cell_threshold=3.0, grid=(36, 64), keyframe_interval=300):
+        self.cell_threshold = cell_threshold
+        self.grid = grid
+        self.keyframe_interval = keyframe_interval
+        self.skipped = 0
+        self._previous = {}
+        self._last_sent = {}
+
+    def has_changed(self, monitor, bgra):
+        thumbnail = luma_thumbnail(bgra, self.grid)
+        previous = self._previous.get(monitor)
+        now = time.monotonic()
+        changed = (previous is None or previous.shape != thumbnail.shape
+                   or float(np.max(np.abs(thumbnail - previous))) > self.cell_threshold
+                   or now - self._last_sent.get(monitor, now) >= self.keyframe_interval)
+        if changed:
+            self._previous[monitor] = thumbnail
+            self._last_sent[monitor] = now
+        else:
+            self.skipped += 1
+        return changed
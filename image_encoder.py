@@ -0,0 +1,92 @@
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+from PIL import Image, ImageDraw, ImageFont
+
+from tracing import span
+
+IMAGE_EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp', 'PNG': '.png'}
+IMAGE_MIME_TYPES = {'.jpg': 'image/jpeg', '.webp': 'image/webp', '.png': 'image/png'}
+
+_local = threading.local()
+
+
+def _font():
+    # Fonts are not shared between encode threads
+    if not hasattr(_local, 'font'):
+        _local.font = ImageFont.load_default()
+    return _local.font
+
+
+def _encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    if image_format == 'PNG':
+        image.save(buffer, 'PNG')
+    else:
+        image.save(buffer, image_format, quality=quality)
+    return buffer.getvalue()
+
+
+def render_and_encode(image, text, image_format, quality, scale=1.0, regions=None):
+    # With `regions` ([(x, y, w, h), ...]) returns one encoded crop per region
+    if scale < 1.0:
+        with span("resize", scale=scale):
+            size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+            image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    if text:
+        with span("overlay"):
+            ImageDraw.Draw(image).text((10, 10), text, font=_font(), fill=(255, 0, 0))
+    with span("encode", format=image_format, regions=len(regions) if regions is not None else None):
+        if regions is None:
+            return _encode(image, image_format, quality)
+        return [_encode(image.crop((x, y, x + w, y + h)), image_format, quality) for x, y, w, h in regions]
+
+
+def _encode_shared(shm_name, size, text, image_format, quality, scale, regions):
+    # Runs in a pool process: build the image straight from the shared BGRX buffer
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = Image.frombuffer("RGB", size, shm.buf, "raw", "BGRX", 0, 1)
+        image.load()
+    finally:
+        shm.close()
+    return render_and_encode(image, text, image_format, quality, scale, regions)
+
+
+# Encodes all monitors of a tick in parallel. In 'thread' mode Pillow releases
+# the GIL inside its encoders, so threads scale across cores without copying
+# frames; in 'process' mode each frame's raw buffer is handed over through one
+# shared-memory block instead of being pickled.
+class ImageEncodePool:
+    def __init__(self, mode='thread', workers=None):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown encode mode {mode!r}; expected thread or process")
+        self.mode = mode
+        workers = workers or os.cpu_count() or 1
+        if mode == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-encode")
+
+    def submit(self, frame, text, image_format='JPEG', quality=20, scale=1.0, regions=None):
+        # Returns a future resolving to the encoded bytes (a list of them with regions)
+        if self.mode == 'thread':
+            return self._executor.submit(
+                lambda: render_and_encode(frame.to_image(), text, image_format, quality, scale, regions))
+        raw = frame.screenshot.raw
+        shm = shared_memory.SharedMemory(create=True, size=len(raw))
+        shm.buf[:len(raw)] = raw
+        future = self._executor.submit(_encode_shared, shm.name, tuple(frame.size), text, image_format,
+                                       quality, scale, regions)
+
+        def release(_):
+            shm.close()
+            shm.unlink()
+        future.add_done_callback(release)
+        return future
+
+    def close(self):
+        self._executor.shutdown(wait=True)
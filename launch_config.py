@@ -0,0 +1,53 @@
+import json
+import os
+
+# Non-interactive launch. Monitor, speaker, bot and audio device choices come
+# from the command line or from a config cached by an earlier run, so a
+# dispatched bot starts recording without prompting or enumerating hardware.
+# Anything still missing falls back to the interactive prompts.
+
+DEFAULT_CONFIG_PATH = os.environ.get("RECORDER_CONFIG", os.path.expanduser("~/.transcriber_client.json"))
+LAUNCH_KEYS = ('monitors', 'max_speakers', 'bot_id', 'device_index')
+
+
+def add_launch_arguments(parser, bot_id=True):
+    parser.add_argument("--monitors", help="comma-separated monitor numbers, or 'all'")
+    parser.add_argument("--max-speakers", type=int)
+    if bot_id:
+        parser.add_argument("--bot-id")
+    parser.add_argument("--device-index", type=int, help="audio input device index (default device if unset)")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_PATH, help="cached launch config")
+    parser.add_argument("--save-config", action="store_true", help="cache the resolved choices for later launches")
+
+
+def load_config(path):
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {key: value for key, value in config.items() if key in LAUNCH_KEYS}
+
+
+def save_config(path, config):
+    temporary = path + ".tmp"
+    with open(temporary, 'w') as f:
+        json.dump({key: config[key] for key in LAUNCH_KEYS if config.get(key) is not None}, f, indent=2)
+    os.replace(temporary, path)
+
+
+def parse_monitors(value):
+    # 'all' stays symbolic; "1,3" becomes 0-based indices [0, 2]
+    if isinstance(value, list) or value == 'all':
+        return value
+    return [int(x) - 1 for x in value.split(',')]
+
+
+def resolve_launch(args):
+    # Command line beats the cached config; keys neither provides are None
+    config = load_config(args.config)
+    for key in LAUNCH_KEYS:
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = parse_monitors(value) if key == 'monitors' else value
+    return {key: config.get(key) for key in LAUNCH_KEYS}
@@ -0,0 +1,293 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, parse_qsl, urlsplit
+
+# Local stand-in for the transcription server, so the client can be exercised
+# offline:  python local_server.py --port 8765  and point SERVER_URL at
+# http://127.0.0.1:8765. Everything received is stored under --root.
+# --latency and --failure-rate make it behave like a slow or flaky server
+# (failed requests are answered with a retryable 503).
+
+
+def parse_multipart(content_type, body):
+    # Returns ({field: value}, {field: (filename, bytes)})
+    message = BytesParser(policy=policy.default).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    fields, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b''
+        if filename is not None:
+            files[name] = (filename, payload)
+        else:
+            fields[name] = payload.decode()
+    return fields, files
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    root = "stand_in_data"
+    latency = 0.0  # seconds added before every response
+    latency_jitter = 0.0  # plus up to this many seconds at random
+    failure_rate = 0.0  # fraction of requests answered with 503
+    quiet = False
+    canvases = {}  # (session_id, monitor) -> (id of the last frame applied, reassembled PIL image) for delta uploads
+    canvases_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            print(f"[stand-in] {self.address_string()} {format % args}")
+
+    def _session_dir(self, session_id):
+        path = os.path.join(self.root, os.path.basename(session_id or "unknown"))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _iter_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Trailer section ends with an empty line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining:
+                data = self.rfile.read(min(remaining, 1 << 16))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+
+    def _read_body(self):
+        return b''.join(self._iter_body())
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        handler = getattr(self, 'post_' + url.path.strip('/').replace('/', '_'), None)
+        if self.latency or self.latency_jitter:
+            time.sleep(self.latency + random.uniform(0, self.latency_jitter))
+        if handler is None:
+            self._read_body()
+            self._send_json({'error': f"unknown endpoint {url.path}"}, status=404)
+            return
+        if random.random() < self.failure_rate:
+            self._read_body()
+            self._send_json({'error': "injected failure"}, status=503)
+            return
+        handler(query)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        handler = getattr(self, 'get_' + url.path.strip('/').replace('/', '_'), None)
+        if handler is None:
+            self._send_json({'error': f"unknown endpoint {url.path}"}, status=404)
+            return
+        handler(query)
+
+    def _stream_path(self, query):
+        return os.path.join(self._session_dir(query.get('session_id')), "stream.pcm")
+
+    def get_stream_audio(self, query):
+        # Where a reconnecting client has to resume from
+        path = self._stream_path(query)
+        self._send_json({'received_bytes': os.path.getsize(path) if os.path.exists(path) else 0})
+
+    def post_stream_audio(self, query):
+        path = self._stream_path(query)
+        offset = int(query.get('offset', 0))
+        held = os.path.getsize(path) if os.path.exists(path) else 0
+        if offset > held:
+            # Appending there would leave a hole; the client has to resend from what is held
+            self.close_connection = True
+            self._send_json({'error': "offset beyond received data", 'received_bytes': held}, status=409)
+            return
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            # Reconnects resend from the offset the client learned from GET; anything after it is replaced
+            f.truncate(offset)
+            f.seek(offset)
+            for data in self._iter_body():
+                f.write(data)
+            received = f.tell()
+        self._send_json({'received_bytes': received, 'rate': query.get('rate'),
+                         'channels': query.get('channels')})
+
+    def _save_upload(self):
+        fields, files = parse_multipart(self.headers['Content-Type'], self._read_body())
+        folder = self._session_dir(fields.get('session_id'))
+        saved = []
+        for filename, payload in files.values():
+            with open(os.path.join(folder, os.path.basename(filename)), 'wb') as f:
+                f.write(payload)
+            saved.append({'filename': filename, 'bytes': len(payload)})
+        return fields, saved
+
+    def post_upload_audio(self, query):
+        fields, saved = self._save_upload()
+        self._send_json({'status': 'ok', 'files': saved, 'fields': fields})
+
+    def post_upload_audio_timestamps(self, query):
+        fields, saved = self._save_upload()
+        self._send_json({'status': 'ok', 'files': saved})
+
+    def _multipart_dir(self, upload_id):
+        return os.path.join(self.root, "multipart", os.path.basename(upload_id))
+
+    def _received_parts(self, folder):
+        return sorted(int(name.split('_')[1]) for name in os.listdir(folder) if name.startswith('part_'))
+
+    def post_upload_audio_multipart_init(self, query):
+        fields = dict(parse_qsl(self._read_body().decode()))
+        # The same file of the same session always maps to the same upload, so a restarted client resumes it
+        upload_id = hashlib.sha256(f"{fields.get('session_id')}/{fields['filename']}/{fields['sha256']}"
+                                   .encode()).hexdigest()[:32]
+        folder = self._multipart_dir(upload_id)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "upload.json"), 'w') as f:
+            json.dump(fields, f)
+        self._send_json({'upload_id': upload_id, 'received': self._received_parts(folder)})
+
+    def post_upload_audio_multipart_part(self, query):
+        data = self._read_body()
+        folder = self._multipart_dir(query['upload_id'])
+        if not os.path.isdir(folder):
+            self._send_json({'error': "unknown upload"}, status=404)
+            return
+        if hashlib.sha256(data).hexdigest() != query['sha256']:
+            self._send_json({'error': "part checksum mismatch"}, status=422)
+            return
+        path = os.path.join(folder, f"part_{int(query['part_number']):06d}")
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self._send_json({'status': 'ok', 'part_number': int(query['part_number']), 'bytes': len(data)})
+
+    def post_upload_audio_multipart_complete(self, query):
+        body = self._read_body()
+        if self.headers.get('Content-Type', '').startswith('multipart/'):
+            fields, files = parse_multipart(self.headers['Content-Type'], body)
+        else:
+            fields, files = dict(parse_qsl(body.decode())), {}
+        folder = self._multipart_dir(fields['upload_id'])
+        with open(os.path.join(folder, "upload.json")) as f:
+            upload = json.load(f)
+        part_size, size = int(upload['part_size']), int(upload['size'])
+        expected = list(range(1, max(1, -(-size // part_size)) + 1))
+        missing = sorted(set(expected) - set(self._received_parts(folder)))
+        if missing:
+            self._send_json({'error': "parts missing", 'missing': missing}, status=409)
+            return
+        session_folder = self._session_dir(upload.get('session_id'))
+        path = os.path.join(session_folder, os.path.basename(upload['filename']))
+        digest = hashlib.sha256()
+        with open(path, 'wb') as out:
+            for number in expected:
+                with open(os.path.join(folder, f"part_{number:06d}"), 'rb') as part:
+                    data = part.read()
+                digest.update(data)
+                out.write(data)
+        if digest.hexdigest() != upload['sha256']:
+            os.remove(path)
+            self._send_json({'error': "file checksum mismatch"}, status=422)
+            return
+        for filename, payload in files.values():
+            with open(os.path.join(session_folder, os.path.basename(filename)), 'wb') as f:
+                f.write(payload)
+        shutil.rmtree(folder)
+        self._send_json({'status': 'ok', 'files': [{'filename': upload['filename'], 'bytes': size}],
+                         'fields': fields})
+
+    def post_upload_image(self, query):
+        fields, saved = self._save_upload()
+        self._send_json({'status': 'ok', 'files': saved, 'fields': fields})
+
+    def post_upload_images(self, query):
+        fields, saved = self._save_upload()
+        manifest = json.loads(fields.get('manifest', '[]'))
+        with open(os.path.join(self._session_dir(fields.get('session_id')), "batches.jsonl"), 'a') as f:
+            f.write(json.dumps(manifest) + "\n")
+        self._send_json({'status': 'ok', 'files': saved, 'images': len(manifest)})
+
+    def post_upload_image_unchanged(self, query):
+        fields = dict(parse_qsl(self._read_body().decode()))
+        with open(os.path.join(self._session_dir(fields.get('session_id')), "unchanged.jsonl"), 'a') as f:
+            f.write(json.dumps(fields) + "\n")
+        self._send_json({'status': 'ok'})
+
+    def post_upload_image_delta(self, query):
+        from PIL import Image  # Only needed to reassemble delta frames
+
+        fields, files = parse_multipart(self.headers['Content-Type'], self._read_body())
+        manifest = json.loads(fields['manifest'])
+        key = (fields.get('session_id'), manifest['monitor'])
+        with self.canvases_lock:
+            last_frame_id, canvas = self.canvases.get(key, (None, None))
+            if manifest['keyframe']:
+                canvas = Image.new("RGB", (manifest['width'], manifest['height']))
+            elif canvas is None or manifest.get('base_frame_id') != last_frame_id:
+                # Applying a delta to any other frame than its base would corrupt the canvas
+                self._send_json({'error': "delta frame does not apply to the last frame received",
+                                 'base_frame_id': manifest.get('base_frame_id'), 'last_frame_id': last_frame_id},
+                                status=409)
+                return
+            for i, tile in enumerate(manifest['tiles']):
+                canvas.paste(Image.open(io.BytesIO(files[f"tile_{i}"][1])), (tile['x'], tile['y']))
+            self.canvases[key] = (manifest['frame_id'], canvas)
+            path = os.path.join(self._session_dir(fields.get('session_id')),
+                                f"frame_monitor_{manifest['monitor']}_{manifest['frame_id']:06d}.png")
+            canvas.save(path)
+        self._send_json({'status': 'ok', 'frame': os.path.basename(path), 'tiles': len(manifest['tiles'])})
+
+
+def serve(host="127.0.0.1", port=8765, root="stand_in_data", latency=0.0, latency_jitter=0.0, failure_rate=0.0,
+          quiet=False):
+    os.makedirs(root, exist_ok=True)
+    handler = type('ConfiguredStandInHandler', (StandInHandler,), {
+        'root': root, 'latency': latency, 'latency_jitter': latency_jitter, 'failure_rate': failure_rate,
+        'quiet': quiet})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in transcription server")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--root', default="stand_in_data")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added before every response")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--quiet', action='store_true', help="do not log every request")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.root, args.latency, args.latency_jitter, args.failure_rate, args.quiet)
+    print(f"Stand-in server listening on http://{args.host}:{args.port}, storing data in {args.root}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
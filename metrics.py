@@ -0,0 +1,217 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        # For totals another component already counts (e.g. the audio engine's overruns)
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), [0, 0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            total[0] += 1
+            total[1] += value
+            self._values[key] = (counts, total)
+
+    def samples(self):
+        with self._lock:
+            samples = []
+            for key, (counts, (count, total)) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((self.name + "_bucket", key + (('le', str(bound)),), bucket_count))
+                samples.append((self.name + "_bucket", key + (('le', "+Inf"),), count))
+                samples.append((self.name + "_count", key, count))
+                samples.append((self.name + "_sum", key, total))
+            return samples
+
+    def summary(self):
+        # {label key: (count, mean)}
+        with self._lock:
+            return {key: (count, total / count if count else 0.0)
+                    for key, (_, (count, total)) in self._values.items()}
+
+
+# Process-wide set of pipeline metrics. Components update them in place;
+# render() produces the Prometheus text format and snapshot() a JSON-friendly
+# dict, both read at request time so instrumentation costs one lock per update.
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help_text, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def _all(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self):
+        lines = []
+        for metric in self._all():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        snapshot = {}
+        for metric in self._all():
+            if isinstance(metric, Histogram):
+                snapshot[metric.name] = [{'labels': dict(key), 'count': count, 'mean': mean}
+                                         for key, (count, mean) in metric.summary().items()]
+            else:
+                snapshot[metric.name] = [{'labels': dict(key), 'value': value} for _, key, value in metric.samples()]
+        return snapshot
+
+    def summary_line(self):
+        # One compact line for the periodic log: totals across labels, histogram means in ms
+        parts = []
+        for metric in self._all():
+            if isinstance(metric, Histogram):
+                summary = metric.summary().values()
+                count = sum(count for count, _ in summary)
+                if count:
+                    mean = sum(count * mean for count, mean in summary) / count
+                    parts.append(f"{metric.name}={count}x{mean * 1000:.0f}ms")
+            else:
+                samples = metric.samples()
+                if samples:
+                    parts.append(f"{metric.name}={sum(value for _, _, value in samples):g}")
+        return "metrics: " + " ".join(parts)
+
+
+METRICS = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = METRICS
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(self.registry.snapshot()).encode(), 'application/json'
+        elif self.path.startswith("/metrics"):
+            body, content_type = self.registry.render().encode(), 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port, host="127.0.0.1", registry=METRICS):
+    # /metrics (Prometheus text) and /metrics.json on a daemon thread
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_metrics_log(interval, registry=METRICS):
+    def log():
+        while True:
+            time.sleep(interval)
+            print(registry.summary_line())
+    thread = threading.Thread(target=log, name="metrics-log", daemon=True)
+    thread.start()
+    return thread
+
+
+def time_future(future, histogram, **labels):
+    # Observes the time from now until the future completes
+    started = time.monotonic()
+    future.add_done_callback(lambda _: histogram.observe(time.monotonic() - started, **labels))
+    return future
+
+
+# Pipeline metrics shared by the recorders and the transport
+audio_frames_captured = METRICS.counter("audio_frames_captured_total", "Audio frames read from the input device")
+audio_overruns = METRICS.counter("audio_overruns_total", "Input overflows reported by PortAudio")
+audio_dropped_frames = METRICS.counter("audio_dropped_frames_total", "Audio frames lost to a full ring buffer")
+audio_ring_bytes = METRICS.gauge("audio_ring_buffered_bytes", "Captured audio waiting in the ring buffer to be drained")
+audio_encoder_pending = METRICS.gauge("audio_encoder_pending_chunks", "Audio chunks queued for the encoder")
+audio_stream_pending = METRICS.gauge("audio_stream_pending_chunks", "Audio chunks queued for the live stream")
+capture_seconds = METRICS.histogram("screenshot_capture_seconds", "Time to grab one monitor")
+encode_seconds = METRICS.histogram("screenshot_encode_seconds", "Time from encode submit to encoded bytes")
+screenshots_unchanged = METRICS.counter("screenshots_unchanged_total", "Frames sent as an unchanged marker")
+screenshots_spilled = METRICS.counter("screenshots_spilled_total", "Frames written to disk after a failed upload")
+capture_missed_ticks = METRICS.counter("capture_missed_ticks_total", "Capture ticks skipped because a tick ran late")
+upload_bytes = METRICS.counter("upload_bytes_total", "Payload bytes uploaded")
+upload_queue_pending = METRICS.gauge("upload_queue_pending", "Uploads waiting for a worker")
+upload_queue_dropped = METRICS.counter("upload_queue_dropped_total", "Uploads dropped by the queue's drop policy")
+upload_queue_failed = METRICS.counter("upload_queue_failed_total", "Queued uploads that raised")
+http_request_seconds = METRICS.histogram("http_request_seconds", "Latency of each HTTP request attempt")
+http_retries = METRICS.counter("http_retries_total", "HTTP requests retried after a transient failure")
+http_failures = METRICS.counter("http_failures_total", "HTTP requests that failed after all retries")
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import traced
+from upload_journal import file_hash
+
+
+# Uploads one large file as fixed-size parts over the multipart protocol:
+#   <path>/init      -> {'upload_id', 'received': [part numbers the server already has]}
+#   <path>/part      one part per request, with its SHA-256 in the query string
+#   <path>/complete  the server joins the parts and checks the whole-file hash
+# Several parts are in flight at once. A part that fails only costs that part:
+# after each round the client asks the server which parts it has and resends
+# the rest, so an interrupted upload (even from an earlier run) resumes from
+# what already arrived instead of starting over.
+class MultipartUploader:
+    def __init__(self, transport, path="/upload/audio/multipart", part_size=8 * 1024 * 1024, parallel_parts=4,
+                 rounds=3):
+        self.transport = transport
+        self.path = path
+        self.part_size = part_size
+        self.parallel_parts = parallel_parts
+        self.rounds = rounds
+        self.bytes_sent = 0
+        self.parts_skipped = 0
+        self._lock = threading.Lock()
+
+    def _init(self, file_path, size, sha256, fields):
+        response = self.transport.post(self.path + "/init", data={
+            **fields, 'filename': os.path.basename(file_path), 'size': size, 'part_size': self.part_size,
+            'sha256': sha256})
+        status = response.json()
+        return status['upload_id'], {int(number) for number in status['received']}
+
+    @traced("upload_part")
+    def _send_part(self, file_path, upload_id, number):
+        with open(file_path, 'rb') as f:
+            f.seek((number - 1) * self.part_size)
+            chunk = f.read(self.part_size)
+        params = {'upload_id': upload_id, 'part_number': number, 'sha256': hashlib.sha256(chunk).hexdigest()}
+        self.transport.post(self.path + "/part", data=chunk, params=params, timeout=120,
+                            headers={'Content-Type': 'application/octet-stream'})
+        with self._lock:
+            self.bytes_sent += len(chunk)
+
+    def upload(self, file_path, fields, files=None, sha256=None):
+        # `fields` go with init and complete; `files` (dict or callable) are attached to complete.
+        # Returns the complete response.
+        size = os.path.getsize(file_path)
+        sha256 = sha256 or file_hash(file_path)
+        part_count = max(1, -(-size // self.part_size))
+        upload_id, received = self._init(file_path, size, sha256, fields)
+        self.parts_skipped += len(received)
+        if received:
+            print(f"Resuming upload of {os.path.basename(file_path)}: {len(received)}/{part_count} parts "
+                  f"already on the server")
+
+        for round_number in range(self.rounds):
+            pending = [number for number in range(1, part_count + 1) if number not in received]
+            if not pending:
+                break
+            with ThreadPoolExecutor(max_workers=self.parallel_parts, thread_name_prefix="upload-part") as pool:
+                futures = {number: pool.submit(self._send_part, file_path, upload_id, number)
+                           for number in pending}
+            failed = [number for number, future in futures.items() if future.exception()]
+            if failed:
+                print(f"{len(failed)} of {len(pending)} parts failed in round {round_number + 1}: "
+                      f"{futures[failed[0]].exception()}")
+            # The server's view is authoritative; it also covers parts that landed before a lost response
+            upload_id, received = self._init(file_path, size, sha256, fields)
+        missing = part_count - len(received)
+        if missing:
+            raise RuntimeError(f"{missing} of {part_count} parts of {file_path} could not be uploaded")
+
+        return self.transport.post(self.path + "/complete", data={**fields, 'upload_id': upload_id},
+                                   files=files, timeout=300)
@@ -0,0 +1,134 @@
+import collections
+import threading
+import time
+
+
+class _MonitorState:
+    def __init__(self, quality):
+        self.quality = quality
+        self.scale = 1.0
+        self.frame_bytes = None  # EWMA of encoded size of frames that were sent
+        self.change_rate = 1.0  # EWMA of how often a tick produces a changed frame
+
+
+# Keeps screenshot traffic inside a bytes-per-second budget. It learns the
+# encoded frame size and change rate per monitor plus the throughput uploads
+# actually achieve, and once per tick trades fidelity for bandwidth: quality
+# first, then downscale, then (for all monitors) a longer capture interval.
+# Recovery runs in the opposite order when there is headroom. Throughput is the
+# bytes all upload workers completed over the last `throughput_window` seconds
+# divided by the time any upload was in flight, so uploads running in parallel
+# are not each mistaken for the whole link.
+class AdaptiveCaptureController:
+    def __init__(self, budget_bytes_per_second, interval, quality=None, min_interval=None, max_interval=60,
+                 min_quality=10, max_quality=80, min_scale=0.25, smoothing=0.3, throughput_window=30.0):
+        self.budget = budget_bytes_per_second
+        self.interval = interval
+        self.min_interval = min_interval or interval
+        self.max_interval = max_interval
+        self.base_quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_scale = min_scale
+        self.smoothing = smoothing
+        self.throughput_window = throughput_window
+        self.upload_throughput = None  # Bytes/second over the window, across all workers
+        self._uploads = collections.deque()  # (start, end, bytes) of uploads finished within the window
+        self.backlog = 0.0  # Pending uploads as a fraction of the queue size
+        self._monitors = {}
+        self._lock = threading.Lock()
+
+    def _ewma(self, current, sample):
+        return sample if current is None else current + self.smoothing * (sample - current)
+
+    def _state(self, monitor):
+        if monitor not in self._monitors:
+            self._monitors[monitor] = _MonitorState(self.base_quality)
+        return self._monitors[monitor]
+
+    def settings(self, monitor):
+        # (quality, scale) to encode this monitor's next frame with
+        with self._lock:
+            state = self._state(monitor)
+            return state.quality, state.scale
+
+    def record_frame(self, monitor, encoded_bytes=None):
+        # encoded_bytes is None for frames skipped as unchanged
+        with self._lock:
+            state = self._state(monitor)
+            state.change_rate = self._ewma(state.change_rate, 0.0 if encoded_bytes is None else 1.0)
+            if encoded_bytes is not None:
+                state.frame_bytes = self._ewma(state.frame_bytes, encoded_bytes)
+
+    def record_upload(self, nbytes, seconds):
+        # Called by each upload worker when its request completes
+        now = time.monotonic()
+        with self._lock:
+            self._uploads.append((now - seconds, now, nbytes))
+            while self._uploads[0][1] < now - self.throughput_window:
+                self._uploads.popleft()
+            busy = self._busy_seconds()
+            if busy > 0:
+                self.upload_throughput = sum(nbytes for _, _, nbytes in self._uploads) / busy
+
+    def _busy_seconds(self):
+        # Length of the union of the upload intervals: overlapping uploads count once
+        busy = 0.0
+        busy_until = float('-inf')
+        for start, end, _ in sorted(self._uploads):
+            if end > busy_until:
+                busy += end - max(start, busy_until)
+                busy_until = end
+        return busy
+
+    def record_backlog(self, pending, capacity):
+        with self._lock:
+            self.backlog = pending / capacity if capacity else 0.0
+
+    def _effective_budget(self):
+        budget = self.budget
+        if self.upload_throughput is not None:
+            budget = min(budget, self.upload_throughput)
+        # A growing queue means uploads are already not keeping up
+        return budget / (1.0 + self.backlog)
+
+    def update(self):
+        # Called once per tick; returns the interval to use for the next one
+        with self._lock:
+            if not self._monitors:
+                return self.interval
+            share = self._effective_budget() / len(self._monitors)
+            all_at_floor = True
+            total_ratio = 0.0
+            for state in self._monitors.values():
+                if state.frame_bytes is None:
+                    continue
+                ratio = state.frame_bytes * state.change_rate / self.interval / share
+                total_ratio += ratio / len(self._monitors)
+                if ratio > 1.1:
+                    all_at_floor &= not self._degrade(state)
+                elif ratio < 0.6:
+                    self._improve(state)
+            if total_ratio > 1.1 and all_at_floor:
+                self.interval = min(self.max_interval, self.interval * min(total_ratio, 2.0))
+            elif total_ratio < 0.6 and self.interval > self.min_interval:
+                self.interval = max(self.min_interval, self.interval * 0.8)
+            return self.interval
+
+    def _degrade(self, state):
+        # Returns False once this monitor cannot be made any cheaper
+        if state.quality is not None and state.quality > self.min_quality:
+            state.quality = max(self.min_quality, int(state.quality * 0.8))
+            return True
+        if state.scale > self.min_scale:
+            state.scale = max(self.min_scale, state.scale * 0.8)
+            return True
+        return False
+
+    def _improve(self, state):
+        if self.interval > self.min_interval:
+            return  # Restore capture rate before fidelity
+        if state.scale < 1.0:
+            state.scale = min(1.0, state.scale * 1.25)
+        elif state.quality is not None and state.quality < self.max_quality:
+            state.quality = min(self.max_quality, state.quality + 5)
@@ -1,31 +1,99 @@
-import pyaudio
-import wave
-import threading
 import time
-import requests
-from mss import mss
-from PIL import Image, ImageDraw, ImageFont
+LAUNCH_TIME = time.monotonic()  # Reference point for time-to-first-frame
+import argparse
+import threading
+import json
 import os
 import signal
 from datetime import datetime
 import logging
 import http.client as http_client
-from requests.exceptions import RequestException
-from screeninfo import get_monitors
+from audio_capture import AudioCaptureEngine
+from audio_encoder import AUDIO_MIME_TYPES, create_encoder
+from audio_stream import AudioStreamer
+from dsp import AudioPreprocessor
+from frame_diff import ChangeDetector
+from image_encoder import IMAGE_EXTENSIONS, IMAGE_MIME_TYPES, ImageEncodePool
+from launch_config import add_launch_arguments, resolve_launch, save_config
+from metrics import (audio_dropped_frames, audio_encoder_pending, audio_frames_captured, audio_overruns,
+                     audio_ring_bytes, audio_stream_pending, capture_missed_ticks, capture_seconds,
+                     encode_seconds, screenshots_spilled, screenshots_unchanged, serve_metrics,
+                     start_metrics_log, time_future, upload_bytes, upload_queue_dropped, upload_queue_failed,
+                     upload_queue_pending)
+from vad import VadGate
+from multipart_upload import MultipartUploader
+from rate_controller import AdaptiveCaptureController
+from scheduler import FixedRateTicker
+from screen_capture import ScreenCaptureEngine
+from spill_store import SpillStore
+from tile_delta import DeltaPlanner
+from timeline import SessionTimeline
+from tracing import TRACER, span, traced
+from transport import get_transport
+from upload_journal import UploadJournal, content_hash, resume_uploads
+from upload_queue import UploadQueue
+from wav_sink import WavSink
 
 # Configuration
 CHUNK = 1024
-FORMAT = pyaudio.paInt16
+FORMAT = 8  # pyaudio.paInt16; PyAudio is only imported once audio is opened
 CHANNELS = 1
 RATE = 44100
-SERVER_URL = "https://transcribe.ohanapal.bot"
+SERVER_URL = os.environ.get("SERVER_URL", "https://transcribe.ohanapal.bot")  # Point at local_server.py to test offline
 SCREENSHOT_INTERVAL = 10  # seconds
+IMAGE_UPLOAD_WORKERS = 4
+IMAGE_UPLOAD_QUEUE_SIZE = 32  # Pending screenshot uploads before the drop policy applies
+IMAGE_UPLOAD_DROP_POLICY = "drop_oldest"  # block, drop_newest or drop_oldest
+IMAGE_FORMAT = "PNG"  # JPEG, WEBP or PNG
+IMAGE_QUALITY = None  # Lossy formats only; lower means smaller files
+IMAGE_ENCODE_MODE = "thread"  # thread or process; both encode all monitors in parallel
+SCREENSHOT_BYTES_PER_SECOND = int(os.environ.get("SCREENSHOT_BYTES_PER_SECOND", 0))  # Adaptive rate/quality budget; 0 disables
+BATCH_SCREENSHOTS = os.environ.get("BATCH_SCREENSHOTS") == "1"  # One upload request for all monitors of a tick
+BATCH_TICKS = 1  # Ticks collected into each batch request
+SCREENSHOT_DELTA = os.environ.get("SCREENSHOT_DELTA") == "1"  # Upload only changed tiles between keyframes
+DELTA_TILE_SIZE = 128  # pixels
+DELTA_KEYFRAME_EVERY = 30  # frames per monitor between full keyframes
+SPILL_MAX_BYTES = 500 * 1024 * 1024  # Cap for screenshots spilled to the session folder after failed uploads
+SPILL_POLICY = "evict_oldest"  # evict_oldest or reject_new once the cap is reached
+SKIP_UNCHANGED_SCREENSHOTS = os.environ.get("SKIP_UNCHANGED_SCREENSHOTS", "1") == "1"  # Send a marker instead of an identical frame
+HTTP2 = os.environ.get("HTTP2") == "1"  # Needs httpx[http2]; falls back to pooled HTTP/1.1
+STREAM_AUDIO = os.environ.get("STREAM_AUDIO") == "1"  # Stream PCM to the server while recording
+AUDIO_CODEC = os.environ.get("AUDIO_CODEC", "wav")  # wav, flac or opus for the uploaded file
+AUDIO_PART_SIZE = 8 * 1024 * 1024  # bytes per part of the resumable audio upload
+AUDIO_UPLOAD_PARALLEL_PARTS = 4  # audio parts in flight at once
+TARGET_RATE = int(os.environ.get("TARGET_RATE", 16000))  # Resample to this rate before storing/sending; 0 keeps RATE
+NORMALIZE_AUDIO = os.environ.get("NORMALIZE_AUDIO", "1") == "1"  # Smoothed gain normalization
+VAD = os.environ.get("VAD") == "1"  # Drop silent spans and upload a timestamp map alongside the audio
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))  # Serve /metrics and /metrics.json on localhost; 0 disables
+METRICS_LOG_INTERVAL = 60  # seconds between metrics log lines; 0 disables
+TRACE_FILE = os.environ.get("TRACE_FILE")  # Write a Chrome trace-event timeline of every stage here; unset disables
 
 # Global variables
 recording = True
-audio_frames = []
 session_folder = ""
 audio_filename = None
+image_upload_queue = None  # Created in main; screenshot uploads run off the capture thread
+image_encoder = None  # Created in main; encodes monitors in parallel
+capture_controller = None  # Created in main when a bandwidth budget is set
+spill_store = None  # Created in main; only failed uploads are written to disk
+upload_journal = None  # Created in main; records what the server already has so a session can be resumed
+timeline = None  # Created in main; shared clock and seek index for the audio and screenshots
+change_detector = ChangeDetector()
+delta_planners = {}  # Per monitor, used when SCREENSHOT_DELTA is on
+delta_lanes = {}  # Per monitor, one worker each so a monitor's deltas reach the server in order
+image_batch = []  # Screenshots waiting for the next batch upload
+image_batch_ticks = 0
+screen_capture = ScreenCaptureEngine()  # Keeps the mss handle alive between ticks
+audio_streamed = False  # Set once the live stream delivered the whole recording
+
+# Pooled keep-alive connections shared by every uploader, with per-endpoint concurrency limits
+transport = get_transport(SERVER_URL, http2=HTTP2,
+                          endpoint_limits={'/upload/image': IMAGE_UPLOAD_WORKERS,
+                                           '/upload/images': IMAGE_UPLOAD_WORKERS, '/upload/audio': 1,
+                                           '/upload/audio/multipart/part': AUDIO_UPLOAD_PARALLEL_PARTS})
+audio_uploader = MultipartUploader(transport, part_size=AUDIO_PART_SIZE, parallel_parts=AUDIO_UPLOAD_PARALLEL_PARTS)
+# Cleared when the server has no unchanged-marker endpoint; every frame is uploaded from then on
+unchanged_markers = SKIP_UNCHANGED_SCREENSHOTS
 
 # Enable HTTP logging
 http_client.HTTPConnection.debuglevel = 0  # Disable HTTP connection debug logging
@@ -50,7 +118,12 @@ def create_session_folder():
     os.makedirs(session_folder, exist_ok=True)
     print(f"Created session folder: {session_folder}")
 
+def get_monitor_count():
+    from screeninfo import get_monitors  # Only needed when monitors are not preselected
+    return len(get_monitors())
+
 def select_monitors():
+    from screeninfo import get_monitors  # Only needed when monitors are not preselected
     monitors = get_monitors()
     print("Available monitors:")
     for i, monitor in enumerate(monitors, start=1):
@@ -66,33 +139,127 @@ def select_monitors():
 def get_max_speakers():
     return int(input("How many speakers? "))
 
+@traced()
 def capture_and_save_screenshot(monitor_indices, session_id):
-    global session_folder
+    global session_folder, image_upload_queue, image_encoder, capture_controller
     print(f"Capturing screenshot for monitors: {monitor_indices}")
-    with mss() as sct:
-        for idx in monitor_indices:
-            print(f"Capturing monitor {idx + 1}")
-            monitor = sct.monitors[idx + 1]
-            screenshot = sct.grab(monitor)
-            img = Image.frombytes("RGB", screenshot.size, screenshot.bgra, "raw", "BGRX")
-            
-            draw = ImageDraw.Draw(img)
-            font = ImageFont.load_default()
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            draw.text((10, 10), timestamp, font=font, fill=(255, 0, 0))
-            
-            filename = f"{session_folder}/screenshot_monitor_{idx + 1}_{timestamp.replace(':', '-')}.png"
-            img.save(filename)
-            print(f"Screenshot saved: {filename}")
-            
-            # Upload the screenshot immediately after saving
-            try:
-                image_response = upload_image_file(filename, session_id)
-                print(f"Screenshot {filename} uploaded successfully.")
-            except Exception as e:
-                print(f"Failed to upload screenshot: {e}")
+    # Grab every monitor first, then encode them all in parallel
+    pending = []
+    for idx in monitor_indices:
+        print(f"Capturing monitor {idx + 1}")
+        grab_started = time.monotonic()
+        frame = screen_capture.grab(idx + 1)
+        capture_seconds.observe(time.monotonic() - grab_started, monitor=idx + 1)
+        # Compare against the last sent frame before any overlay is drawn
+        with span("change_detect", monitor=idx + 1):
+            changed = not unchanged_markers or change_detector.has_changed(idx, frame.bgra)
+        if not changed:
+            print(f"Monitor {idx + 1} unchanged, sending marker only")
+            screenshots_unchanged.inc(monitor=idx + 1)
+            if capture_controller:
+                capture_controller.record_frame(idx)
+            image_upload_queue.submit(upload_unchanged_marker, idx + 1, session_id, frame.capture_time,
+                                      timeline.at(frame.monotonic_time))
+            continue
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        quality, scale = capture_controller.settings(idx) if capture_controller else (IMAGE_QUALITY, 1.0)
+        if SCREENSHOT_DELTA:
+            # Tiles are addressed in full-resolution pixels, so delta mode never downscales
+            if idx not in delta_planners:
+                delta_planners[idx] = DeltaPlanner(DELTA_TILE_SIZE, DELTA_KEYFRAME_EVERY)
+                delta_lanes[idx] = UploadQueue(1, IMAGE_UPLOAD_QUEUE_SIZE, IMAGE_UPLOAD_DROP_POLICY,
+                                               name=f"delta-upload-{idx + 1}", on_evict=spill_evicted_upload)
+            delta = delta_planners[idx].plan(frame.bgra)
+            encoded = time_future(image_encoder.submit(frame, timestamp, IMAGE_FORMAT, quality, regions=delta.regions),
+                                  encode_seconds, monitor=idx + 1)
+            pending.append((idx, frame, timestamp, encoded, delta))
+        else:
+            encoded = time_future(image_encoder.submit(frame, timestamp, IMAGE_FORMAT, quality, scale),
+                                  encode_seconds, monitor=idx + 1)
+            pending.append((idx, frame, timestamp, encoded, None))
+
+    for idx, frame, timestamp, encoded, delta in pending:
+        session_time = timeline.at(frame.monotonic_time)
+        if delta:
+            with span("encode_wait", monitor=idx + 1):
+                tiles = encoded.result()
+            if capture_controller:
+                capture_controller.record_frame(idx, sum(map(len, tiles)))
+            keyframe = delta.base_frame_id is None
+            manifest = {'monitor': idx + 1, 'frame_id': delta.frame_id, 'keyframe_id': delta.keyframe_id,
+                        'base_frame_id': delta.base_frame_id, 'keyframe': keyframe, 'width': frame.size[0],
+                        'height': frame.size[1], 'format': IMAGE_FORMAT, 'timestamp': timestamp,
+                        'session_time': round(session_time, 3),
+                        'tiles': [{'x': x, 'y': y, 'w': w, 'h': h} for x, y, w, h in delta.regions]}
+            timeline.record_delta(idx + 1, session_time, delta.frame_id, delta.keyframe_id)
+            print(f"Monitor {idx + 1}: {'keyframe' if keyframe else f'{len(delta.regions)} changed tiles'}, "
+                  f"{sum(map(len, tiles))} bytes")
+            if not delta_lanes[idx].submit(upload_image_delta, manifest, tiles, session_id):
+                print(f"Upload queue full, dropping delta frame for monitor {idx + 1}.")
+                delta_planners[idx].mark_lost(delta.frame_id)
+            continue
+
+        # Encoded frames stay in memory; they only reach the disk if the upload fails
+        filename = f"screenshot_monitor_{idx + 1}_{timestamp.replace(':', '-')}{IMAGE_EXTENSIONS[IMAGE_FORMAT]}"
+        with span("encode_wait", monitor=idx + 1):
+            data = encoded.result()
+        if capture_controller:
+            capture_controller.record_frame(idx, len(data))
+        print(f"Screenshot encoded: {filename} ({len(data)} bytes)")
+        digest = content_hash(data)
+        timeline.record_frame(idx + 1, session_time, digest)
+        if not upload_journal.record(filename, 'screenshot', digest, len(data), monitor=idx + 1,
+                                     capture_time=frame.capture_time, session_time=session_time):
+            print(f"Screenshot {filename} already uploaded, skipping.")
+            continue
+
+        if BATCH_SCREENSHOTS:
+            image_batch.append({'filename': filename, 'data': data, 'sha256': digest, 'monitor': idx + 1,
+                                'captured_at': f"{frame.capture_time:.3f}", 'session_time': f"{session_time:.3f}"})
+            continue
+
+        # Hand the upload to the worker pool so capture cadence does not depend on the network
+        if not image_upload_queue.submit(upload_screenshot, filename, data, digest, session_id, session_time):
+            print(f"Upload queue full, spilling screenshot {filename} to disk.")
+            spill_screenshot(filename, data)
+
+    if BATCH_SCREENSHOTS:
+        flush_image_batch(session_id)
+
+def upload_screenshot(filename, data, digest, session_id, session_time):
+    upload_started = time.monotonic()
+    try:
+        upload_image_file(filename, session_id, session_time, content=data)
+    except Exception as e:
+        upload_journal.mark_failed(digest, e)
+        spill_screenshot(filename, data)
+        raise
+    upload_journal.mark_uploaded(digest)
+    upload_bytes.inc(len(data), kind='screenshot')
+    if capture_controller:
+        capture_controller.record_upload(len(data), time.monotonic() - upload_started)
+    print(f"Screenshot {filename} uploaded successfully.")
+
+def spill_screenshot(filename, data):
+    path = spill_store.spill(filename, data)
+    if path:
+        print(f"Screenshot spilled to disk: {path}")
+        screenshots_spilled.inc()
+    else:
+        print(f"Spill folder is full, screenshot {filename} discarded.")
+
+def spill_evicted_upload(fn, args, kwargs):
+    # Jobs pushed out of a full upload queue keep their frames on disk
+    if fn is upload_screenshot:
+        spill_screenshot(args[0], args[1])
+    elif fn is upload_image_batch:
+        for entry in args[0]:
+            spill_screenshot(entry['filename'], entry['data'])
+    elif fn is upload_image_delta:
+        delta_planners[args[0]['monitor'] - 1].mark_lost(args[0]['frame_id'])
 
 def list_audio_devices():
+    import pyaudio
     p = pyaudio.PyAudio()
     info = p.get_host_api_info_by_index(0)
     numdevices = info.get('deviceCount')
@@ -104,149 +271,389 @@ def list_audio_devices():
     
     p.terminate()
 
-def record_audio(session_id, max_speakers):
-    global recording, audio_frames, session_folder, audio_filename
-    p = pyaudio.PyAudio()
-    
-    # Automatically use the default input device
-    device_index = None  # None will use the default device
+def record_audio(session_id, max_speakers, device_index=None):
+    global recording, session_folder, audio_filename, audio_streamed
+    # None uses the default input device
+    engine = AudioCaptureEngine(FORMAT, CHANNELS, RATE, CHUNK, device_index=device_index)
+
+    # Downmix, resample and normalize before anything is stored or sent
+    audio_source = engine
+    preprocessor = None
+    # With VAD on, gain normalization waits until after the gate: the gate has to judge
+    # the signal at its recorded level, or boosted room noise passes for speech
+    normalize_early = NORMALIZE_AUDIO and not VAD
+    if TARGET_RATE or normalize_early or CHANNELS > 1:
+        preprocessor = AudioPreprocessor(RATE, CHANNELS, target_rate=TARGET_RATE, normalize=normalize_early)
+        engine.add_consumer(preprocessor.feed)
+        audio_source = preprocessor
+
+    vad_gate = None
+    if VAD:
+        vad_gate = VadGate(audio_source.rate)
+        audio_source.add_consumer(vad_gate.feed)
+        audio_source = vad_gate
+        if NORMALIZE_AUDIO:
+            normalizer = AudioPreprocessor(audio_source.rate, 1, target_rate=None, normalize=True)
+            audio_source.add_consumer(normalizer.feed)
+            audio_source = normalizer
+
+    # Chunks are written to disk as they arrive instead of being held in memory
+    audio_basename = f"{session_folder}/audio_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    audio_filename = audio_basename + ".wav"
+    sink = WavSink(audio_filename, audio_source.channels, audio_source.sample_width, audio_source.rate)
+    audio_source.add_consumer(sink.write)
+    audio_source.add_consumer(timeline.audio_tap(engine, sink).feed)
 
+    # The WAV stays on disk as the master copy; the upload uses the encoded file
     try:
-        stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, 
-                        frames_per_buffer=CHUNK, input_device_index=device_index)
+        encoder = create_encoder(AUDIO_CODEC, audio_basename, audio_source.rate, audio_source.channels,
+                                 audio_source.sample_width)
+    except (RuntimeError, ValueError) as e:
+        print(f"Audio encoder unavailable, uploading WAV instead: {e}")
+        encoder = None
+    if encoder:
+        audio_source.add_consumer(encoder.feed)
+
+    streamer = None
+    if STREAM_AUDIO:
+        streamer = AudioStreamer(SERVER_URL, session_id, audio_source.rate, audio_source.channels,
+                                 audio_source.sample_width,
+                                 extra_params={'max_speakers': max_speakers})
+        audio_source.add_consumer(streamer.feed)
+
+    try:
+        engine.start()
     except IOError as e:
         print(f"Error opening stream: {e}")
-        p.terminate()
+        sink.close()
+        if encoder:
+            encoder.close()
+            os.remove(encoder.path)
+        os.remove(audio_filename)
+        audio_filename = None
         return
 
+    if streamer:
+        streamer.start()
     print("* Recording audio")
-    start_time = time.time()
-    frames_count = 0
-
+    losses = 0
     while recording:
-        try:
-            data = stream.read(CHUNK, exception_on_overflow=False)
-            audio_frames.append(data)
-            frames_count += 1
-            if frames_count % 100 == 0:  # Print every ~1 second
-                duration = time.time() - start_time
-                print(f"Recording... Duration: {duration:.2f} seconds, Frames: {frames_count}, Data size: {len(b''.join(audio_frames))} bytes")
-        except IOError as e:
-            print(f"Error recording audio: {e}")
-
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
-    print("Audio recording stopped")
+        time.sleep(1)
+        stats = engine.stats()
+        if stats['overruns'] + stats['dropped_frames'] > losses:
+            # Marks the second in which audio was lost, to line up with whatever stalled the drain
+            losses = stats['overruns'] + stats['dropped_frames']
+            TRACER.instant("audio_loss", overruns=stats['overruns'], dropped_frames=stats['dropped_frames'])
+        audio_frames_captured.set(stats['frames_captured'])
+        audio_overruns.set(stats['overruns'])
+        audio_dropped_frames.set(stats['dropped_frames'])
+        # Queue depths show which stage falls behind before frames are actually lost
+        audio_ring_bytes.set(stats['buffered_bytes'])
+        if encoder:
+            audio_encoder_pending.set(encoder.pending_chunks)
+        if streamer:
+            audio_stream_pending.set(streamer.pending_chunks)
+        print(f"Recording... Duration: {engine.duration:.2f} seconds, Frames: {stats['frames_captured']}, "
+              f"Data size: {sink.data_bytes} bytes, Overruns: {stats['overruns']}, "
+              f"Dropped frames: {stats['dropped_frames']}")
 
-    # Save the audio file
-    audio_filename = f"{session_folder}/audio_{datetime.now().strftime('%Y%m%d_%H%M%S')}.wav"
-    wf = wave.open(audio_filename, 'wb')
-    wf.setnchannels(CHANNELS)
-    wf.setsampwidth(p.get_sample_size(FORMAT))
-    wf.setframerate(RATE)
-    wf.writeframes(b''.join(audio_frames))
-    wf.close()
+    engine.stop()
+    if preprocessor:
+        preprocessor.flush()
+    if vad_gate:
+        vad_gate.flush()
+        vad_gate.save_timestamp_map(audio_basename + ".vad.json")
+        print(f"Voice activity kept {vad_gate.kept_ratio:.0%} of the recording")
+    sink.close()
+    print("Audio recording stopped")
     print(f"Audio saved: {audio_filename}")
 
+    if encoder:
+        if encoder.close():
+            print(f"Audio encoded: {encoder.path} ({os.path.getsize(encoder.path)} bytes, "
+                  f"WAV was {os.path.getsize(audio_filename)} bytes)")
+            audio_filename = encoder.path
+        else:
+            print(f"Audio encoding failed, uploading WAV instead: {encoder.error}")
+
+    audio_digest = upload_journal.record_file(audio_filename, 'audio')
+    if streamer:
+        streamer.close()
+        if streamer.complete:
+            print("Audio streamed to server during recording; skipping full file upload.")
+            if vad_gate:
+                upload_timestamp_map(audio_basename + ".vad.json", session_id)
+            upload_journal.mark_uploaded(audio_digest)
+            audio_streamed = True
+            return
+
     # Upload the audio file immediately after saving
     try:
-        audio_response = upload_audio_file(audio_filename, session_id, max_speakers)
+        audio_response = upload_audio_file(audio_filename, session_id, max_speakers, sha256=audio_digest)
+        upload_journal.mark_uploaded(audio_digest)
         print(f"Audio file {audio_filename} uploaded successfully.")
     except Exception as e:
+        upload_journal.mark_failed(audio_digest, e)
         print(f"Failed to upload audio: {e}")
 
 def screenshot_thread(monitor_indices, session_id):
-    global recording
+    global recording, capture_controller
     print(f"Screenshot thread started for monitors: {monitor_indices}")
     screenshot_count = 0
+    ticker = FixedRateTicker(SCREENSHOT_INTERVAL)
     while recording:
+        ticker.wait()
+        if not recording:
+            break
         capture_and_save_screenshot(monitor_indices, session_id)
         screenshot_count += 1
-        print(f"Screenshot {screenshot_count} captured and uploaded. Sleeping for {SCREENSHOT_INTERVAL} seconds before next capture...")
-        time.sleep(SCREENSHOT_INTERVAL)
+        if screenshot_count == 1:
+            print(f"Time to first frame: {time.monotonic() - LAUNCH_TIME:.3f}s")
+        stats = image_upload_queue.stats()
+        stats['pending'] += sum(map(len, delta_lanes.values()))
+        upload_queue_pending.set(stats['pending'])
+        upload_queue_dropped.set(stats['dropped'])
+        upload_queue_failed.set(stats['failed'])
+        capture_missed_ticks.set(ticker.missed_ticks)
+        if capture_controller:
+            capture_controller.record_backlog(stats['pending'], IMAGE_UPLOAD_QUEUE_SIZE)
+            ticker.interval = capture_controller.update()
+        print(f"Screenshot {screenshot_count} captured. Uploads pending: {stats['pending']}, "
+              f"dropped: {stats['dropped']}, missed ticks: {ticker.missed_ticks}, interval: {ticker.interval:.1f}s")
+    if BATCH_SCREENSHOTS:
+        flush_image_batch(session_id, final=True)
+    screen_capture.close()
     print(f"Screenshot thread stopped. Total screenshots: {screenshot_count}")
 
-def upload_audio_file(audio_file_path, session_id, max_speakers):
-    url = f"{SERVER_URL}/upload/audio"
-    retries = 3
-    backoff_factor = 2
+@traced()
+def upload_audio_file(audio_file_path, session_id, max_speakers, sha256=None):
+    def sidecar_files():
+        # Trimmed (VAD) audio carries its map back to the original timeline; the session's seek indexes go along
+        files = {}
+        timestamp_map_path = os.path.splitext(audio_file_path)[0] + ".vad.json"
+        if os.path.exists(timestamp_map_path):
+            files['timestamp_map'] = (os.path.basename(timestamp_map_path), open(timestamp_map_path, 'rb'),
+                                      'application/json')
+        folder = os.path.dirname(audio_file_path) or "."
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(".idx"):
+                files[f"index_{name[:-4]}"] = (name, open(os.path.join(folder, name), 'rb'),
+                                               'application/octet-stream')
+        return files
 
-    for attempt in range(retries):
-        try:
-            with open(audio_file_path, 'rb') as file:
-                files = {'file': (os.path.basename(audio_file_path), file, 'audio/wav')}
-                data = {'session_id': session_id, 'max_speakers': max_speakers}
-                print(f"Uploading audio file {audio_file_path} to {url}")
-                response = requests.post(url, files=files, data=data, timeout=60)  # Increased timeout
-                response.raise_for_status()
-                print(f"Audio file uploaded successfully. Server response: {response.status_code}")
-                return response.json()
-        except requests.RequestException as e:
-            print(f"Failed to upload audio file: {e}")
-            if attempt < retries - 1:
-                sleep_time = backoff_factor ** attempt
-                print(f"Retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
-            else:
-                raise
+    def files():
+        content_type = AUDIO_MIME_TYPES.get(os.path.splitext(audio_file_path)[1], 'audio/wav')
+        return {'file': (os.path.basename(audio_file_path), open(audio_file_path, 'rb'), content_type),
+                **sidecar_files()}
 
-def upload_image_file(image_file_path, session_id):
-    url = f"{SERVER_URL}/upload/image"
-    retries = 3
-    backoff_factor = 2
+    data = {'session_id': session_id, 'max_speakers': max_speakers}
+    print(f"Uploading audio file {audio_file_path} to {SERVER_URL}/upload/audio")
+    try:
+        response = upload_audio_parts(audio_file_path, data, files, sidecar_files, sha256)
+    except Exception as e:
+        print(f"Failed to upload audio file: {e}")
+        raise
+    print(f"Audio file uploaded successfully. Server response: {response.status_code}")
+    upload_bytes.inc(os.path.getsize(audio_file_path), kind='audio')
+    return response.json()
 
-    for attempt in range(retries):
-        try:
-            with open(image_file_path, 'rb') as file:
-                files = {'file': (os.path.basename(image_file_path), file, 'image/png')}
-                data = {'session_id': session_id}
-                print(f"Uploading image file {image_file_path} to {url}")
-                response = requests.post(url, files=files, data=data, timeout=60)  # Increased timeout
-                response.raise_for_status()
-                print(f"Image file uploaded successfully. Server response: {response.status_code}")
-                return response.json()
-        except requests.RequestException as e:
-            print(f"Failed to upload image file: {e}")
-            if attempt < retries - 1:
-                sleep_time = backoff_factor ** attempt
-                print(f"Retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
-            else:
-                raise
-
-def send_data_to_server(session_folder, session_id, max_speakers):
-    print(f"Sending data from {session_folder} to server...")
-    for filename in os.listdir(session_folder):
-        filepath = os.path.join(session_folder, filename)
-        if filename.startswith("audio_"):
-            print(f"Skipping audio file: {filename}")  # Skip uploading audio files again
-        elif filename.startswith("screenshot_"):
-            print(f"Uploading image file: {filename}")
-            image_response = upload_image_file(filepath, session_id)
-            print(f"Image file {filename} uploaded successfully.")
+def upload_audio_parts(audio_file_path, data, files, sidecar_files, sha256=None):
+    # Resumable parallel parts; servers without the multipart endpoints get the file in one request
+    try:
+        return audio_uploader.upload(audio_file_path, data, files=sidecar_files, sha256=sha256)
+    except Exception as e:
+        response = getattr(e, 'response', None)
+        if response is None or response.status_code != 404:
+            raise
+    print("Server does not support multipart audio upload; sending the file in one request")
+    return transport.post("/upload/audio", data=data, files=files, retries=1, timeout=None)
+
+def upload_timestamp_map(timestamp_map_path, session_id):
+    def files():
+        return {'timestamp_map': (os.path.basename(timestamp_map_path), open(timestamp_map_path, 'rb'),
+                                  'application/json')}
+
+    try:
+        response = transport.post("/upload/audio/timestamps", data={'session_id': session_id}, files=files)
+        print(f"Timestamp map uploaded successfully. Server response: {response.status_code}")
+    except Exception as e:
+        print(f"Failed to upload timestamp map: {e}")
+
+@traced()
+def upload_image_file(image_file_path, session_id, session_time=None, content=None):
+    # With `content`, the encoded bytes are sent from memory and image_file_path only names the part
+    def files():
+        content_type = IMAGE_MIME_TYPES.get(os.path.splitext(image_file_path)[1], 'image/png')
+        body = content if content is not None else open(image_file_path, 'rb')
+        return {'file': (os.path.basename(image_file_path), body, content_type)}
+
+    data = {'session_id': session_id}
+    if session_time is not None:
+        data['session_time'] = f"{session_time:.3f}"
+    print(f"Uploading image file {image_file_path} to {SERVER_URL}/upload/image")
+    try:
+        response = transport.post("/upload/image", data=data, files=files, retries=3, timeout=60)
+    except Exception as e:
+        print(f"Failed to upload image file: {e}")
+        raise
+    print(f"Image file uploaded successfully. Server response: {response.status_code}")
+    return response.json()
+
+def flush_image_batch(session_id, final=False):
+    # Queues the collected screenshots as one request once BATCH_TICKS ticks are in
+    global image_batch, image_batch_ticks
+    image_batch_ticks += 0 if final else 1
+    if not image_batch or (image_batch_ticks < BATCH_TICKS and not final):
+        return
+    batch, image_batch, image_batch_ticks = image_batch, [], 0
+    if not image_upload_queue.submit(upload_image_batch, batch, session_id):
+        print(f"Upload queue full, spilling batch of {len(batch)} screenshots to disk.")
+        for entry in batch:
+            spill_screenshot(entry['filename'], entry['data'])
+
+def upload_image_batch(batch, session_id):
+    files = {f"image_{i}": (entry['filename'], entry['data'],
+                            IMAGE_MIME_TYPES.get(os.path.splitext(entry['filename'])[1], 'image/png'))
+             for i, entry in enumerate(batch)}
+    manifest = [{key: value for key, value in entry.items() if key != 'data'} | {'field': f"image_{i}"}
+                for i, entry in enumerate(batch)]
+    data = {'session_id': session_id, 'manifest': json.dumps(manifest)}
+    print(f"Uploading batch of {len(batch)} screenshots to {SERVER_URL}/upload/images")
+    upload_started = time.monotonic()
+    try:
+        response = transport.post("/upload/images", data=data, files=files, retries=3, timeout=60)
+    except Exception as e:
+        for entry in batch:
+            upload_journal.mark_failed(entry['sha256'], e)
+            spill_screenshot(entry['filename'], entry['data'])
+        raise
+    for entry in batch:
+        upload_journal.mark_uploaded(entry['sha256'])
+    upload_bytes.inc(sum(len(entry['data']) for entry in batch), kind='batch')
+    if capture_controller:
+        capture_controller.record_upload(sum(len(entry['data']) for entry in batch),
+                                         time.monotonic() - upload_started)
+    print(f"Screenshot batch uploaded successfully. Server response: {response.status_code}")
+
+def upload_image_delta(manifest, tiles, session_id):
+    def files():
+        extension = IMAGE_EXTENSIONS[manifest['format']]
+        return {f"tile_{i}": (f"tile_{i}{extension}", tile, IMAGE_MIME_TYPES[extension])
+                for i, tile in enumerate(tiles)}
+
+    planner = delta_planners[manifest['monitor'] - 1]
+    if planner.is_stale(manifest['frame_id'], manifest['keyframe_id']):
+        print(f"Skipping delta frame {manifest['frame_id']} for monitor {manifest['monitor']}: "
+              f"it builds on a frame the server never got.")
+        return
+    data = {'session_id': session_id, 'manifest': json.dumps(manifest)}
+    upload_started = time.monotonic()
+    try:
+        transport.post("/upload/image/delta", data=data, files=files, retries=3, timeout=60)
+    except Exception:
+        # The server's canvas is now out of date; restart this monitor from a keyframe
+        planner.mark_lost(manifest['frame_id'])
+        raise
+    upload_bytes.inc(sum(map(len, tiles)), kind='delta')
+    if capture_controller:
+        capture_controller.record_upload(sum(map(len, tiles)), time.monotonic() - upload_started)
+    print(f"Delta frame {manifest['frame_id']} for monitor {manifest['monitor']} uploaded successfully.")
+
+def upload_unchanged_marker(monitor_number, session_id, capture_time, session_time):
+    data = {'session_id': session_id, 'monitor': monitor_number, 'captured_at': f"{capture_time:.3f}",
+            'session_time': f"{session_time:.3f}"}
+    global unchanged_markers
+    try:
+        transport.post("/upload/image/unchanged", data=data, retries=3, timeout=60)
+    except Exception as e:
+        response = getattr(e, 'response', None)
+        if response is None or response.status_code != 404:
+            raise
+        # The frame matched the last one uploaded, so the server still has its content
+        unchanged_markers = False
+        print("Server does not accept unchanged markers; uploading every frame from now on")
+
+def resume_session(folder):
+    # Upload whatever the journal says the server is still missing for an earlier session.
+    # Screenshots from folders that predate the journal are picked up by name.
+    journal = UploadJournal(folder)
+    journal.adopt("screenshot_", 'screenshot')
+    session_id = journal.session.get('session_id', os.path.basename(os.path.normpath(folder)))
+    max_speakers = journal.session.get('max_speakers')
+
+    def upload(entry, path):
+        if entry['kind'] == 'audio':
+            upload_audio_file(path, session_id, max_speakers, sha256=entry['sha256'])
         else:
-            print(f"Skipping file: {filename}")
+            upload_image_file(path, session_id, entry.get('session_time'))
 
-def main():
-    global recording, session_folder, audio_filename
+    def uploaded(entry, path):
+        # Spilled screenshots are deleted once the server has them; adopted ones are the user's files
+        if entry['kind'] == 'screenshot' and not entry.get('adopted'):
+            spills.discard(path)
+
+    # The audio is only journaled once recording ends; after a crash the WAV sink's file is all there is
+    recovered = [] if journal.has_kind('audio') else journal.adopt("audio_", 'audio', suffix=".wav")
+    spills = SpillStore(folder, SPILL_MAX_BYTES, SPILL_POLICY)
+    print(f"Resuming session {session_id}: {len(journal.missing())} artifacts not yet uploaded")
+    results = resume_uploads(journal, upload, workers=IMAGE_UPLOAD_WORKERS, on_uploaded=uploaded)
+    journal.close()
+    print(f"Resume finished: {results['uploaded']} uploaded, {results['failed']} failed, "
+          f"{results['unrecoverable']} no longer on disk")
+    if recovered:
+        print(f"Recovered audio the interrupted session never journaled: {', '.join(recovered)}")
+
+def main(launch=None, config_path=None, save=False):
+    # `launch` holds choices resolved from the command line / cached config; missing ones are prompted for
+    global recording, session_folder, audio_filename, image_upload_queue, image_encoder, capture_controller, spill_store, \
+        upload_journal, timeline
+    launch = launch or {}
+    transport.warm_up()  # Build the HTTP client in the background while capture starts
     
     try:
         print("Starting main function...")
+        if METRICS_PORT:
+            serve_metrics(METRICS_PORT)
+            print(f"Metrics served at http://127.0.0.1:{METRICS_PORT}/metrics")
+        if METRICS_LOG_INTERVAL:
+            start_metrics_log(METRICS_LOG_INTERVAL)
+        if TRACE_FILE:
+            TRACER.start(TRACE_FILE)
+            print(f"Tracing to {TRACE_FILE}")
         create_session_folder()
+        spill_store = SpillStore(session_folder, SPILL_MAX_BYTES, SPILL_POLICY)
+        upload_journal = UploadJournal(session_folder)
         
-        selected_monitors = select_monitors()
-        max_speakers = get_max_speakers()
+        selected_monitors = launch.get('monitors')
+        if selected_monitors == 'all':
+            selected_monitors = list(range(get_monitor_count()))
+        elif selected_monitors is None:
+            selected_monitors = select_monitors()
+        max_speakers = launch.get('max_speakers') or get_max_speakers()
+        if save and config_path:
+            save_config(config_path, {'monitors': selected_monitors, 'max_speakers': max_speakers,
+                                      'device_index': launch.get('device_index')})
+            print(f"Launch config saved to {config_path}")
         session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        timeline = SessionTimeline(session_folder)  # Session time 0 is here, once every prompt is answered
+        upload_journal.start_session(session_id=session_id, start_time=timeline.wall_origin, max_speakers=max_speakers)
         
         print(f"Selected monitors: {[i+1 for i in selected_monitors]}")
         print(f"Max speakers set to: {max_speakers}")
         
         print("Starting audio recording thread...")
-        audio_thread = threading.Thread(target=record_audio, args=(session_id, max_speakers))
+        audio_thread = threading.Thread(target=record_audio,
+                                        args=(session_id, max_speakers, launch.get('device_index')))
         audio_thread.start()
         
         print("Starting screenshot thread...")
+        image_encoder = ImageEncodePool(IMAGE_ENCODE_MODE)
+        if SCREENSHOT_BYTES_PER_SECOND:
+            capture_controller = AdaptiveCaptureController(SCREENSHOT_BYTES_PER_SECOND, SCREENSHOT_INTERVAL,
+                                                           quality=IMAGE_QUALITY)
+        image_upload_queue = UploadQueue(IMAGE_UPLOAD_WORKERS, IMAGE_UPLOAD_QUEUE_SIZE,
+                                         IMAGE_UPLOAD_DROP_POLICY, name="image-upload",
+                                         on_evict=spill_evicted_upload)
         ss_thread = threading.Thread(target=screenshot_thread, args=(selected_monitors, session_id))
         ss_thread.start()
         
@@ -261,11 +668,25 @@ def main():
         print("Waiting for threads to finish...")
         audio_thread.join()
         ss_thread.join()
+        image_encoder.close()
+        print("Waiting for pending screenshot uploads...")
+        image_upload_queue.close()
+        for lane in delta_lanes.values():
+            lane.close()
+        timeline.close()
         
-        if audio_filename:
-            upload_audio_file(audio_filename, session_id, max_speakers)
+        if audio_streamed:
+            print("Audio already streamed to server.")
+        elif audio_filename:
+            audio_digest = upload_journal.record_file(audio_filename, 'audio')
+            if upload_journal.is_uploaded(audio_digest):
+                print("Audio already uploaded.")
+            else:
+                upload_audio_file(audio_filename, session_id, max_speakers, sha256=audio_digest)
+                upload_journal.mark_uploaded(audio_digest)
         else:
             print("No audio file was created.")
+        upload_journal.close()
         
         print("Session completed.")
     
@@ -273,8 +694,17 @@ def main():
         print(f"An unexpected error occurred: {e}")
     finally:
         print("Recording and screenshot capture completed.")
+        TRACER.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", metavar="SESSION_FOLDER",
+                        help="upload what an earlier session's journal shows as missing, then exit")
+    add_launch_arguments(parser, bot_id=False)
+    args = parser.parse_args()
     print("Script started")
-    main()
+    if args.resume:
+        resume_session(args.resume)
+    else:
+        main(resolve_launch(args), args.config, args.save_config)
     print("Script ended")
\ No newline at end of file
@@ -0,0 +1,154 @@
+import argparse
+import glob
+import json
+import os
+import re
+import wave
+from datetime import datetime
+
+from timeline import AUDIO_INDEX_FILENAME, FRAME_DELTA, TimelineReader, digest_prefix
+from upload_journal import JOURNAL_FILENAME, file_hash
+
+# Seeks a recorded session by time using its timeline indexes: for any moment
+# it finds the audio byte offset and the screenshot each monitor was showing,
+# by bisecting the index files instead of scanning the WAV or the folder.
+# Works on a local session folder or on the stand-in server's copy of one.
+#
+#   python replay.py SESSION_FOLDER                      summary
+#   python replay.py SESSION_FOLDER --at 1:02:03         what was captured at that moment
+#   python replay.py SESSION_FOLDER --at 62 --extract clip.wav --duration 30
+
+
+def parse_time(value):
+    # Seconds, MM:SS or HH:MM:SS, with optional fractions
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:06.3f}"
+
+
+def screenshot_names(folder):
+    # SHA-256 prefix -> screenshot filename, from the upload journal or else by hashing the screenshots present
+    names = {}
+    journal_path = os.path.join(folder, JOURNAL_FILENAME)
+    if os.path.exists(journal_path):
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('event') == 'artifact' and event.get('kind') == 'screenshot':
+                    names[digest_prefix(event['sha256'])] = event['name']
+    else:
+        for name in os.listdir(folder):
+            if name.startswith("screenshot_"):
+                names[digest_prefix(file_hash(os.path.join(folder, name)))] = name
+    return names
+
+
+class SessionReplay:
+    def __init__(self, folder):
+        self.folder = folder
+        audio_index = os.path.join(folder, AUDIO_INDEX_FILENAME)
+        self.audio = TimelineReader(audio_index) if os.path.exists(audio_index) else None
+        self.frames = {}  # monitor number -> TimelineReader
+        for name in os.listdir(folder):
+            match = re.fullmatch(r"frames_monitor_(\d+)\.idx", name)
+            if match:
+                self.frames[int(match.group(1))] = TimelineReader(os.path.join(folder, name))
+        wavs = sorted(glob.glob(os.path.join(folder, "audio_*.wav")))
+        self.wav_path = wavs[-1] if wavs else None
+        self._names = None
+
+    def _screenshot_name(self, prefix):
+        if self._names is None:
+            self._names = screenshot_names(self.folder)
+        return self._names.get(prefix)
+
+    def at(self, session_time):
+        result = {'time': session_time, 'audio_offset': None, 'frames': {}}
+        if self.audio:
+            result['audio_offset'] = self.audio.audio_offset(session_time)
+        for monitor, reader in sorted(self.frames.items()):
+            record = reader.at(session_time)
+            if record is None:
+                continue
+            frame_time, kind, extra, value = record
+            if kind == FRAME_DELTA:
+                frame = {'time': frame_time, 'frame_id': value, 'keyframe_id': extra,
+                         'name': f"frame_monitor_{monitor}_{value:06d}.png"}  # As the server reassembles it
+            else:
+                frame = {'time': frame_time, 'name': self._screenshot_name(value)}
+            result['frames'][monitor] = frame
+        return result
+
+    def extract(self, start, duration, out_path):
+        # Copies the audio recorded between start and start + duration; stretches with no audio are skipped
+        if not (self.audio and self.wav_path):
+            raise ValueError(f"No audio index and WAV in {self.folder}")
+        frame_bytes = self.audio.channels * self.audio.sample_width
+        first = self.audio.audio_offset(start) or 0
+        last = self.audio.audio_offset(start + duration) or 0
+        with wave.open(self.wav_path, 'rb') as source, wave.open(out_path, 'wb') as out:
+            out.setparams(source.getparams())
+            source.setpos(min(first // frame_bytes, source.getnframes()))
+            out.writeframes(source.readframes(max(0, last - first) // frame_bytes))
+        return (last - first) / self.audio.bytes_per_second
+
+    def summary(self):
+        lines = []
+        reader = self.audio or next(iter(self.frames.values()), None)
+        if reader:
+            lines.append(f"Session started {datetime.fromtimestamp(reader.wall_origin):%Y-%m-%d %H:%M:%S}")
+        if self.audio and len(self.audio):
+            first, last = self.audio[0], self.audio[len(self.audio) - 1]
+            lines.append(f"Audio: {format_time(first[0])} - {format_time(last[0])}, {last[3]} bytes, "
+                         f"{len(self.audio)} index points ({self.wav_path})")
+        for monitor, frames in sorted(self.frames.items()):
+            if len(frames):
+                lines.append(f"Monitor {monitor}: {len(frames)} frames, {format_time(frames[0][0])} - "
+                             f"{format_time(frames[len(frames) - 1][0])}")
+        return "\n".join(lines) or f"No timeline index in {self.folder}"
+
+    def close(self):
+        for reader in [self.audio, *self.frames.values()]:
+            if reader:
+                reader.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seek a recorded session by time")
+    parser.add_argument("folder", help="session folder holding audio.idx / frames_monitor_N.idx")
+    parser.add_argument("--at", type=parse_time, help="session time: seconds, MM:SS or HH:MM:SS")
+    parser.add_argument("--extract", metavar="WAV", help="write the audio from --at onwards to this file")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of audio to extract")
+    args = parser.parse_args()
+
+    replay = SessionReplay(args.folder)
+    try:
+        if args.at is None:
+            print(replay.summary())
+        else:
+            moment = replay.at(args.at)
+            print(f"At {format_time(args.at)}:")
+            if moment['audio_offset'] is None:
+                print("  audio: not recording yet")
+            elif replay.audio[len(replay.audio) - 1][0] + 1 < args.at:
+                print("  audio: past the end of the recording")
+            else:
+                print(f"  audio: byte {moment['audio_offset']} of {replay.wav_path}")
+            for monitor, frame in moment['frames'].items():
+                print(f"  monitor {monitor}: {frame['name'] or 'unknown frame'} "
+                      f"captured at {format_time(frame['time'])}")
+            if args.extract:
+                seconds = replay.extract(args.at, args.duration, args.extract)
+                print(f"Wrote {seconds:.1f}s of audio to {args.extract}")
+    finally:
+        replay.close()
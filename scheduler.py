@@ -0,0 +1,113 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+# Fixed-rate scheduler on the monotonic clock. Ticks stay on the original grid
+# however long each iteration takes; ticks that are already past are skipped
+# (and counted) instead of being run back to back.
+class FixedRateTicker:
+    def __init__(self, interval):
+        self.interval = interval
+        self.missed_ticks = 0
+        self._next = time.monotonic()
+
+    def wait(self):
+        now = time.monotonic()
+        if now > self._next:
+            missed = int((now - self._next) // self.interval)
+            self.missed_ticks += missed
+            self._next += missed * self.interval
+        delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+        self._next += self.interval
+
+
+class ScheduledJob:
+    def __init__(self, callback, interval, due):
+        self.callback = callback
+        self.interval = interval  # May be changed between ticks
+        self.missed_ticks = 0
+        self.due = due
+        self.cancelled = False
+        self.finished = threading.Event()
+
+
+# Runs the periodic work of many recording sessions on one thread. Every job
+# keeps its own fixed-rate grid with the same late-tick skipping as
+# FixedRateTicker, so sessions sharing the thread do not drift each other.
+class PeriodicScheduler:
+    def __init__(self, name="scheduler"):
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._running_job = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def add(self, callback, interval):
+        # The first tick runs as soon as the scheduler thread gets to it
+        job = ScheduledJob(callback, interval, time.monotonic())
+        with self._condition:
+            heapq.heappush(self._heap, (job.due, next(self._order), job))
+            self._condition.notify()
+        return job
+
+    def cancel(self, job, wait=True):
+        # With wait, returns only once a tick of this job in progress has finished
+        with self._condition:
+            job.cancelled = True
+            if job is not self._running_job:
+                job.finished.set()
+            self._condition.notify()
+        if wait:
+            job.finished.wait()
+
+    def _next_job(self):
+        with self._condition:
+            while not self._closed:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, _, job = self._heap[0]
+                if job.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = due - time.monotonic()
+                if delay <= 0:
+                    heapq.heappop(self._heap)
+                    self._running_job = job
+                    return job
+                self._condition.wait(delay)
+            return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                job.callback()
+            except Exception as e:
+                print(f"Scheduled job {job.callback} failed: {e}")
+            with self._condition:
+                self._running_job = None
+                if job.cancelled:
+                    job.finished.set()
+                    continue
+                job.due += job.interval
+                now = time.monotonic()
+                if now > job.due:
+                    missed = int((now - job.due) // job.interval)
+                    job.missed_ticks += missed
+                    job.due += missed * job.interval
+                heapq.heappush(self._heap, (job.due, next(self._order), job))
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
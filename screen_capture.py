@@ -0,0 +1,65 @@
+import threading
+import time
+
+from PIL import Image
+
+from frame_diff import bgra_view
+from tracing import span
+
+
+# One grabbed monitor image. `bgra` is a NumPy view over mss's raw buffer and
+# to_image() builds the RGB image straight from that buffer, skipping the
+# bytes copy that ScreenShot.bgra and Image.frombytes each make.
+# `capture_time` is wall-clock; `monotonic_time` places the frame on the
+# session timeline.
+class Frame:
+    def __init__(self, screenshot, monitor_number, capture_time, monotonic_time=None):
+        self.screenshot = screenshot
+        self.monitor_number = monitor_number
+        self.capture_time = capture_time
+        self.monotonic_time = monotonic_time
+
+    @property
+    def size(self):
+        return self.screenshot.size
+
+    @property
+    def bgra(self):
+        return bgra_view(self.screenshot)
+
+    def to_image(self):
+        return Image.frombuffer("RGB", self.screenshot.size, self.screenshot.raw, "raw", "BGRX", 0, 1)
+
+
+# Persistent capture engine: the mss handle is created once and reused for
+# every tick instead of per capture. mss handles are bound to the thread that
+# opened them, so the handle is opened lazily by the first grab on the capture
+# thread. `source` creates the handle (mss unless the benchmark's synthetic
+# screen is passed in).
+class ScreenCaptureEngine:
+    def __init__(self, source=None):
+        self._source = source
+        self._sct = None
+        self._owner = None
+
+    def _handle(self):
+        if self._sct is None or self._owner is not threading.current_thread():
+            self.close()
+            if self._source is None:
+                from mss import mss  # Imported on the capture thread, only when real screens are grabbed
+                self._source = mss
+            self._sct = self._source()
+            self._owner = threading.current_thread()
+        return self._sct
+
+    def grab(self, monitor_number):
+        sct = self._handle()
+        with span("grab", monitor=monitor_number):
+            screenshot = sct.grab(sct.monitors[monitor_number])
+        return Frame(screenshot, monitor_number, time.time(), time.monotonic())
+
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+            self._owner = None
@@ -0,0 +1,67 @@
+import os
+import threading
+
+from tracing import span
+
+SPILL_POLICIES = ('evict_oldest', 'reject_new')
+
+
+# Disk spill for encoded screenshots whose upload failed. Frames normally live
+# only in memory; this is the one place they touch the session folder. The
+# spilled files are capped at `max_bytes`: 'evict_oldest' deletes the oldest
+# spills to make room, 'reject_new' keeps what is there and drops the new frame.
+# Only files this store wrote (prefix 'screenshot_') are ever evicted.
+class SpillStore:
+    def __init__(self, folder, max_bytes=500 * 1024 * 1024, policy='evict_oldest'):
+        if policy not in SPILL_POLICIES:
+            raise ValueError(f"Unknown spill policy {policy!r}; expected one of {', '.join(SPILL_POLICIES)}")
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.evicted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        # Pick up spills left by an earlier run of the same session, oldest first
+        self._files = []
+        if os.path.isdir(folder):
+            for name in sorted(os.listdir(folder), key=lambda n: os.path.getmtime(os.path.join(folder, n))):
+                if name.startswith("screenshot_"):
+                    self._files.append((os.path.join(folder, name), os.path.getsize(os.path.join(folder, name))))
+        self.total_bytes = sum(size for _, size in self._files)
+
+    def spill(self, filename, data):
+        # Returns the path written, or None if the retention policy refused it
+        path = os.path.join(self.folder, os.path.basename(filename))
+        with self._lock:
+            if len(data) > self.max_bytes:
+                self.rejected += 1
+                return None
+            while self.total_bytes + len(data) > self.max_bytes:
+                if self.policy == 'reject_new':
+                    self.rejected += 1
+                    return None
+                oldest, size = self._files.pop(0)
+                try:
+                    os.remove(oldest)
+                except FileNotFoundError:
+                    pass
+                self.total_bytes -= size
+                self.evicted += 1
+            with span("spill_write", size=len(data)), open(path, 'wb') as f:
+                f.write(data)
+            self._files.append((path, len(data)))
+            self.total_bytes += len(data)
+            return path
+
+    def discard(self, path):
+        # Forget (and delete) a spill that has since been uploaded
+        with self._lock:
+            for i, (spilled, size) in enumerate(self._files):
+                if spilled == path:
+                    del self._files[i]
+                    self.total_bytes -= size
+                    break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
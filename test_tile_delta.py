@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+import requests
+from PIL import Image
+
+from image_encoder import render_and_encode
+from local_server import serve
+from tile_delta import DeltaPlanner
+
+# Delta frames sent losslessly (PNG tiles) through the stand-in server must
+# reassemble into exactly the frames that were captured.
+
+WIDTH, HEIGHT, TILE = 300, 200, 64  # Not multiples of the tile, so edge tiles are partial
+
+
+@pytest.fixture
+def server(tmp_path):
+    httpd = serve(port=0, root=str(tmp_path), quiet=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", tmp_path
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def frames(count, seed=0):
+    rng = np.random.default_rng(seed)
+    bgra = rng.integers(0, 256, size=(HEIGHT, WIDTH, 4), dtype=np.uint8)
+    for _ in range(count):
+        yield bgra.copy()
+        # Repaint a random rectangle, sometimes none at all
+        if rng.random() < 0.8:
+            x, y = rng.integers(0, WIDTH - 1), rng.integers(0, HEIGHT - 1)
+            w, h = rng.integers(1, WIDTH - x + 1), rng.integers(1, HEIGHT - y + 1)
+            bgra[y:y + h, x:x + w] = rng.integers(0, 256, size=(h, w, 4), dtype=np.uint8)
+
+
+def to_image(bgra):
+    return Image.frombuffer("RGB", (WIDTH, HEIGHT), bgra.tobytes(), "raw", "BGRX", 0, 1)
+
+
+def post_delta(url, session_id, delta, tiles, monitor=1):
+    manifest = {'monitor': monitor, 'frame_id': delta.frame_id, 'keyframe_id': delta.keyframe_id,
+                'base_frame_id': delta.base_frame_id, 'keyframe': delta.base_frame_id is None,
+                'width': WIDTH, 'height': HEIGHT, 'format': 'PNG',
+                'tiles': [{'x': x, 'y': y, 'w': w, 'h': h} for x, y, w, h in delta.regions]}
+    files = {f"tile_{i}": (f"tile_{i}.png", tile, 'image/png') for i, tile in enumerate(tiles)}
+    return requests.post(url + "/upload/image/delta", data={'session_id': session_id, 'manifest': json.dumps(manifest)},
+                         files=files, timeout=10)
+
+
+def test_lossless_round_trip(server):
+    url, root = server
+    planner = DeltaPlanner(TILE, keyframe_every=5)
+    for bgra in frames(12):
+        delta = planner.plan(bgra)
+        source = to_image(bgra)
+        tiles = render_and_encode(source.copy(), None, 'PNG', 0, regions=delta.regions)
+        response = post_delta(url, "round-trip", delta, tiles)
+        assert response.status_code == 200, response.text
+        with Image.open(os.path.join(root, "round-trip", response.json()['frame'])) as received:
+            assert np.array_equal(np.asarray(received.convert("RGB")), np.asarray(source))
+
+
+def test_delta_on_a_lost_base_is_rejected(server):
+    url, _ = server
+    planner = DeltaPlanner(TILE)
+    planned = []
+    for bgra in frames(3, seed=1):
+        delta = planner.plan(bgra)
+        planned.append((delta, render_and_encode(to_image(bgra), None, 'PNG', 0, regions=delta.regions)))
+
+    assert post_delta(url, "lost-base", *planned[0]).status_code == 200
+    # Frame 1 never arrives; frame 2 builds on it
+    planner.mark_lost(planned[1][0].frame_id)
+    assert planner.is_stale(planned[2][0].frame_id, planned[2][0].keyframe_id)
+    assert post_delta(url, "lost-base", *planned[2]).status_code == 409
+
+    # The next frame is a keyframe again and is not stale
+    delta = planner.plan(next(frames(1, seed=2)))
+    assert delta.base_frame_id is None
+    assert not planner.is_stale(delta.frame_id, delta.keyframe_id)
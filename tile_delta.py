@@ -0,0 +1,86 @@
+import collections
+import threading
+
+import numpy as np
+
+_weights = {}
+
+
+def _tile_weights(tile):
+    # Fixed pseudo-random 64-bit weights, one per pixel position in a tile
+    if tile not in _weights:
+        rng = np.random.default_rng(0x5EED)
+        _weights[tile] = rng.integers(1, 2 ** 63, size=(tile, tile), dtype=np.uint64) | np.uint64(1)
+    return _weights[tile]
+
+
+def tile_hashes(bgra, tile=128):
+    # (rows, cols) grid of 64-bit hashes over tile x tile blocks, computed as a
+    # weighted sum (mod 2**64) of the packed BGRA pixels in one vectorized pass
+    height, width = bgra.shape[:2]
+    rows, cols = -(-height // tile), -(-width // tile)
+    pixels = np.ascontiguousarray(bgra).view(np.uint32).reshape(height, width)
+    if height % tile or width % tile:
+        pixels = np.pad(pixels, ((0, rows * tile - height), (0, cols * tile - width)))
+    blocks = pixels.reshape(rows, tile, cols, tile).astype(np.uint64)
+    return np.einsum('rycx,yx->rc', blocks, _tile_weights(tile))
+
+
+# One planned frame. base_frame_id is the frame the server must have applied
+# before this one (None for a keyframe).
+DeltaFrame = collections.namedtuple('DeltaFrame', ['frame_id', 'keyframe_id', 'base_frame_id', 'regions'])
+
+
+# Plans what to send for each new frame of one monitor: a keyframe (a single
+# region covering the whole frame) every `keyframe_every` frames or when the
+# resolution changes, otherwise only the tiles whose hash changed since the
+# previous frame. The top-left tile is always included because it carries the
+# timestamp overlay. Deltas only make sense applied in order, so the planned
+# frames must be uploaded one at a time per monitor; when one of them is lost,
+# mark_lost() makes the next frame a keyframe and is_stale() flags the deltas
+# already queued on top of the lost one. Planning and loss reports may come
+# from different threads.
+class DeltaPlanner:
+    def __init__(self, tile=128, keyframe_every=30):
+        self.tile = tile
+        self.keyframe_every = keyframe_every
+        self.frame_id = -1
+        self.keyframe_id = None
+        self._hashes = None
+        self._since_keyframe = 0
+        self._last_lost = -1
+        self._lock = threading.Lock()
+
+    def plan(self, bgra):
+        height, width = bgra.shape[:2]
+        hashes = tile_hashes(bgra, self.tile)
+        with self._lock:
+            previous, self._hashes = self._hashes, hashes
+            self.frame_id += 1
+            if previous is None or previous.shape != hashes.shape or self._since_keyframe >= self.keyframe_every:
+                self.keyframe_id = self.frame_id
+                self._since_keyframe = 1
+                return DeltaFrame(self.frame_id, self.keyframe_id, None, [(0, 0, width, height)])
+            self._since_keyframe += 1
+            frame_id, keyframe_id = self.frame_id, self.keyframe_id
+        changed = hashes != previous
+        changed[0, 0] = True
+        return DeltaFrame(frame_id, keyframe_id, frame_id - 1, self._regions(changed, width, height))
+
+    def mark_lost(self, frame_id):
+        # Call when a planned frame never reached the server
+        with self._lock:
+            self._hashes = None
+            self._last_lost = max(self._last_lost, frame_id)
+
+    def is_stale(self, frame_id, keyframe_id):
+        # True for a delta that builds on a lost frame; the server would only reject it
+        with self._lock:
+            return keyframe_id <= self._last_lost < frame_id
+
+    def _regions(self, mask, width, height):
+        regions = []
+        for row, col in np.argwhere(mask):
+            x, y = int(col) * self.tile, int(row) * self.tile
+            regions.append((x, y, min(self.tile, width - x), min(self.tile, height - y)))
+        return regions
@@ -0,0 +1,210 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+AUDIO_INDEX_FILENAME = "audio.idx"
+INDEX_MAGIC = b"TLIX"
+INDEX_VERSION = 1
+
+# Header: magic, version, record size, session start (wall clock), and for the
+# audio index the PCM layout (rate, channels, sample width) that turns byte
+# offsets into positions in any encoding of the same audio.
+_HEADER = struct.Struct('<4sHHdIHH')
+# Record: session time (seconds), kind, extra, value
+_RECORD = struct.Struct('<dIIQ')
+
+AUDIO_POINT = 0  # value = byte offset into the PCM data (the WAV's data chunk)
+FRAME_FULL = 1  # value = first 8 bytes of the encoded frame's SHA-256
+FRAME_DELTA = 2  # value = delta frame id, extra = its keyframe id
+
+
+def frame_index_filename(monitor_number):
+    return f"frames_monitor_{monitor_number}.idx"
+
+
+def digest_prefix(sha256):
+    return int(sha256[:16], 16)
+
+
+# Append-only index of fixed-size records in time order. Records are written
+# (and flushed) one at a time, so a crash loses at most a torn last record,
+# which readers ignore.
+class TimelineIndex:
+    def __init__(self, path, wall_origin, rate=0, channels=0, sample_width=0):
+        self.path = path
+        self.last_time = float('-inf')
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, _RECORD.size, wall_origin, rate, channels,
+                                      sample_width))
+        self._file.flush()
+
+    def append(self, session_time, kind, value, extra=0):
+        with self._lock:
+            if self._file is None:
+                return
+            # Keeps the file sorted for bisection even if two stamps race
+            session_time = max(session_time, self.last_time)
+            self._file.write(_RECORD.pack(session_time, kind, extra, value))
+            self._file.flush()
+            self.last_time = session_time
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _Times:
+    # Sequence of record times, so bisect can search the mapped file directly
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, i):
+        return self.reader[i][0]
+
+
+# Read side of a TimelineIndex. The file is memory-mapped and searched by
+# bisection, so a seek costs O(log n) record reads whatever the session length.
+class TimelineReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.wall_origin, self.rate, self.channels, self.sample_width = \
+            _HEADER.unpack_from(self._map)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or record_size != _RECORD.size:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} timeline index")
+        self._count = (len(self._map) - _HEADER.size) // _RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return _RECORD.unpack_from(self._map, _HEADER.size + i * _RECORD.size)
+
+    @property
+    def bytes_per_second(self):
+        return self.rate * self.channels * self.sample_width
+
+    def seek(self, session_time):
+        # Position of the last record at or before session_time, or -1
+        return bisect.bisect_right(_Times(self), session_time) - 1
+
+    def at(self, session_time):
+        i = self.seek(session_time)
+        return self[i] if i >= 0 else None
+
+    def audio_offset(self, session_time):
+        # Byte offset into the PCM data for session_time. Between two points the
+        # audio is continuous; if the next point is a jump (audio lost or trimmed
+        # by VAD) the offset stops at the jump. None before the audio starts.
+        i = self.seek(session_time)
+        if i < 0:
+            return None
+        point_time, _, _, offset = self[i]
+        frame_bytes = self.channels * self.sample_width
+        offset += int((session_time - point_time) * self.rate) * frame_bytes
+        if i + 1 < len(self):
+            offset = min(offset, self[i + 1][3])
+        return offset
+
+    def close(self):
+        self._map.close()
+
+
+# One session's clock and seek index. Every stamp is time.monotonic() taken
+# where the data was captured, expressed as seconds since the session started,
+# so audio and screenshots share a timeline that wall-clock changes cannot
+# shift. The wall-clock start is kept only to label the session.
+class SessionTimeline:
+    def __init__(self, folder):
+        self.folder = folder
+        self.origin = time.monotonic()
+        self.wall_origin = time.time()
+        self._frame_indexes = {}
+        self._audio_index = None
+        self._lock = threading.Lock()
+
+    def now(self):
+        return time.monotonic() - self.origin
+
+    def at(self, monotonic_time):
+        return monotonic_time - self.origin
+
+    def audio_tap(self, engine, sink):
+        # Consumer to register right after `sink` on the same audio source
+        self._audio_index = TimelineIndex(os.path.join(self.folder, AUDIO_INDEX_FILENAME), self.wall_origin,
+                                          sink.rate, sink.channels, sink.sample_width)
+        return AudioTimelineTap(self, self._audio_index, engine, sink)
+
+    def _frame_index(self, monitor_number):
+        with self._lock:
+            if monitor_number not in self._frame_indexes:
+                path = os.path.join(self.folder, frame_index_filename(monitor_number))
+                self._frame_indexes[monitor_number] = TimelineIndex(path, self.wall_origin)
+            return self._frame_indexes[monitor_number]
+
+    def record_frame(self, monitor_number, session_time, sha256):
+        self._frame_index(monitor_number).append(session_time, FRAME_FULL, digest_prefix(sha256))
+
+    def record_delta(self, monitor_number, session_time, frame_id, keyframe_id):
+        self._frame_index(monitor_number).append(session_time, FRAME_DELTA, frame_id, keyframe_id)
+
+    def index_files(self):
+        with self._lock:
+            indexes = list(self._frame_indexes.values())
+        if self._audio_index:
+            indexes.append(self._audio_index)
+        return [index.path for index in indexes]
+
+    def close(self):
+        with self._lock:
+            indexes = list(self._frame_indexes.values())
+        for index in indexes + ([self._audio_index] if self._audio_index else []):
+            index.close()
+
+
+# Records where the WAV's bytes sit on the session timeline. A chunk is stamped
+# with the time the engine captured its last sample (to within one capture
+# chunk) and the sink's byte count after writing it. A point is written once a
+# second, and wherever the audio is not continuous with the last point (lost
+# frames, VAD trims), so offsets between points can be interpolated.
+class AudioTimelineTap:
+    def __init__(self, timeline, index, engine, sink, interval=1.0, tolerance=0.1):
+        self.timeline = timeline
+        self.index = index
+        self.engine = engine
+        self.sink = sink
+        self.interval = interval
+        self.tolerance = tolerance
+        self.bytes_per_second = sink.rate * sink.channels * sink.sample_width
+        self._last = None  # (session time, offset) of the last point written
+
+    def _point(self, session_time, offset):
+        self.index.append(session_time, AUDIO_POINT, offset)
+        self._last = (session_time, offset)
+
+    def feed(self, data):
+        end_time = self.timeline.at(self.engine.read_time)
+        end_offset = self.sink.data_bytes
+        start_time = end_time - len(data) / self.bytes_per_second
+        start_offset = end_offset - len(data)
+        if self._last is None:
+            self._point(start_time, start_offset)
+        else:
+            last_time, last_offset = self._last
+            expected = last_time + (start_offset - last_offset) / self.bytes_per_second
+            if abs(start_time - expected) > self.tolerance:
+                self._point(start_time, start_offset)
+        if end_time - self._last[0] >= self.interval:
+            self._point(end_time, end_offset)
@@ -0,0 +1,136 @@
+import functools
+import json
+import os
+import threading
+import time
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def set(self, **args):
+        # Attach results known only inside the span (status code, byte count...)
+        self.args.update(args)
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._emit({'name': self.name, 'ph': 'X', 'ts': (self.start - self.tracer.origin) * 1e6,
+                           'dur': (end - self.start) * 1e6, 'args': self.args})
+        return False
+
+
+# Opt-in wall-clock tracing in the Chrome trace-event format (open the file in
+# chrome://tracing or ui.perfetto.dev). Every span becomes a complete event on
+# the thread that ran it, so encode workers, upload workers and the audio drain
+# show up as separate tracks. While disabled, span() returns a shared no-op
+# context manager. Events are buffered and appended to the file in batches; a
+# file cut short by a crash is still loadable because the closing bracket of
+# the JSON array format is optional.
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self._events = []
+        self._named_threads = set()
+        self._lock = threading.Lock()
+        self._file = None
+        self._written = 0
+        self._flush_every = 1000
+
+    def start(self, path, flush_every=1000):
+        with self._lock:
+            self._file = open(path, 'w')
+            self._file.write("[\n")
+            self._flush_every = flush_every
+            self._events.append({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                                 'args': {'name': "recorder"}})
+            self.enabled = True
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def instant(self, name, **args):
+        if self.enabled:
+            self._emit({'name': name, 'ph': 'i', 's': 't', 'ts': (time.perf_counter() - self.origin) * 1e6,
+                        'args': args})
+
+    def _emit(self, event):
+        thread_id = threading.get_native_id()
+        event['pid'] = os.getpid()
+        event['tid'] = thread_id
+        with self._lock:
+            if not self.enabled:
+                return
+            if thread_id not in self._named_threads:
+                self._named_threads.add(thread_id)
+                self._events.append({'name': 'thread_name', 'ph': 'M', 'pid': event['pid'], 'tid': thread_id,
+                                     'args': {'name': threading.current_thread().name}})
+            self._events.append(event)
+            if len(self._events) >= self._flush_every:
+                self._flush()
+
+    def _flush(self):
+        for event in self._events:
+            self._file.write((",\n" if self._written else "") + json.dumps(event))
+            self._written += 1
+        self._events.clear()
+        self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.write("\n]\n")
+            self._file.close()
+            self._file = None
+            self.enabled = False
+
+
+TRACER = Tracer()
+
+
+def span(name, **args):
+    return TRACER.span(name, **args)
+
+
+def traced(name=None):
+    # Decorator form of span() named after the function
+    def decorate(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            with _Span(TRACER, span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,137 @@
+import importlib.util
+import random
+import threading
+import time
+
+from metrics import http_failures, http_request_seconds, http_retries
+from tracing import span
+
+# requests/httpx are imported when the first request is made (or by warm_up),
+# keeping them off the startup path
+requests = None
+httpx = None
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# Shared HTTP transport for every uploader. One pooled keep-alive session (or an
+# HTTP/2 client when httpx is installed) is reused across uploads, so repeated
+# screenshot uploads skip the TCP/TLS handshake. Each endpoint gets its own
+# concurrency limit, and retries use capped exponential backoff with full jitter.
+# The client is created on first use.
+class Transport:
+    def __init__(self, base_url, pool_size=16, http2=False, endpoint_limits=None, default_limit=8):
+        self.base_url = base_url.rstrip('/')
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self.default_limit = default_limit
+        self.pool_size = pool_size
+        self.retries_performed = 0
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+        # httpx only speaks HTTP/2 with the h2 package installed (httpx[http2])
+        self.http2 = http2 and all(importlib.util.find_spec(name) is not None for name in ('httpx', 'h2'))
+        if http2 and not self.http2:
+            print("HTTP/2 requested but httpx[http2] is not installed; using pooled HTTP/1.1")
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        global requests, httpx
+        with self._client_lock:
+            if self._client is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                if self.http2:
+                    try:
+                        import httpx
+                        self._client = httpx.Client(http2=True, limits=httpx.Limits(
+                            max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+                    except ImportError as e:
+                        print(f"HTTP/2 client unavailable ({e}); using pooled HTTP/1.1")
+                        self.http2 = False
+                if self._client is None:
+                    self._client = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    self._client.mount('https://', adapter)
+                    self._client.mount('http://', adapter)
+            return self._client
+
+    def warm_up(self):
+        # Builds the client on a background thread so the first upload does not pay for the imports
+        threading.Thread(target=self._get_client, name="transport-warm-up", daemon=True).start()
+
+    def _semaphore(self, path):
+        with self._semaphores_lock:
+            if path not in self._semaphores:
+                self._semaphores[path] = threading.BoundedSemaphore(self.endpoint_limits.get(path, self.default_limit))
+            return self._semaphores[path]
+
+    def _is_retryable(self, error):
+        response = getattr(error, 'response', None)
+        if response is not None:
+            return response.status_code in RETRY_STATUS_CODES
+        if httpx is not None and isinstance(error, httpx.HTTPError):
+            return isinstance(error, httpx.TransportError)
+        return isinstance(error, requests.RequestException)
+
+    @staticmethod
+    def backoff(attempt, backoff_factor=2, max_backoff=30):
+        # Full jitter keeps many clients (or monitors) from retrying in lockstep
+        return random.uniform(0, min(max_backoff, backoff_factor ** attempt))
+
+    def post(self, path, data=None, files=None, retries=3, timeout=60, backoff_factor=2, max_backoff=30,
+             **kwargs):
+        # `files` may be a callable returning the files dict, so every attempt
+        # gets freshly opened file objects; those are closed after the attempt.
+        url = self.base_url + path
+        for attempt in range(retries):
+            attempt_files = files() if callable(files) else files
+            try:
+                semaphore = self._semaphore(path)
+                # Waiting for an endpoint slot is traced apart from the request so contention shows up
+                with span("http_slot_wait", path=path):
+                    semaphore.acquire()
+                try:
+                    started = time.monotonic()
+                    with span("http_request", path=path, attempt=attempt) as request_span:
+                        response = self._get_client().post(url, data=data, files=attempt_files, timeout=timeout,
+                                                           **kwargs)
+                        request_span.set(status=response.status_code)
+                finally:
+                    http_request_seconds.observe(time.monotonic() - started, path=path)
+                    semaphore.release()
+                response.raise_for_status()
+                return response
+            except Exception as e:
+                if not self._is_retryable(e) or attempt >= retries - 1:
+                    http_failures.inc(path=path)
+                    raise
+                sleep_time = self.backoff(attempt, backoff_factor, max_backoff)
+                self.retries_performed += 1
+                http_retries.inc(path=path)
+                print(f"Request to {path} failed: {e}. Retrying in {sleep_time:.1f} seconds...")
+                time.sleep(sleep_time)
+            finally:
+                if callable(files):
+                    for value in attempt_files.values():
+                        handle = value[1] if isinstance(value, tuple) else value
+                        if hasattr(handle, 'close'):
+                            handle.close()
+
+    def close(self):
+        with self._client_lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(base_url, **kwargs):
+    # One transport per server, shared by every uploader in the process
+    with _transports_lock:
+        if base_url not in _transports:
+            _transports[base_url] = Transport(base_url, **kwargs)
+        return _transports[base_url]
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+JOURNAL_FILENAME = "upload_journal.jsonl"
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Append-only record of every artifact a session produced and whether the
+# server has it. Artifacts are keyed by their SHA-256, so the same content is
+# only ever uploaded once. Each line is one JSON event and is flushed before
+# the call returns. Session, uploaded and failed events are also fsynced (with
+# `sync`), which makes every artifact line written before them durable too, so
+# recording an artifact never waits on the disk by itself. A torn last line
+# left by a crash is ignored when the journal is reopened.
+class UploadJournal:
+    def __init__(self, folder, filename=JOURNAL_FILENAME, sync=True):
+        self.folder = folder
+        self.path = os.path.join(folder, filename)
+        self.sync = sync
+        self.session = {}
+        self.entries = {}  # sha256 -> {'name', 'kind', 'sha256', 'size', 'state', ...metadata}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                content = f.read()
+                complete = content.rfind(b"\n") + 1
+                for line in content[:complete].splitlines():
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        continue
+                # Drop a torn tail so the next event starts on its own line
+                f.truncate(complete)
+        self._file = open(self.path, 'a')
+
+    def _apply(self, event):
+        kind = event.pop('event')
+        if kind == 'session':
+            self.session.update(event)
+        elif kind == 'artifact':
+            self.entries.setdefault(event['sha256'], dict(event, state='pending'))
+        elif kind in ('uploaded', 'failed') and event['sha256'] in self.entries:
+            self.entries[event['sha256']]['state'] = kind
+
+    def _append(self, event, sync=True):
+        with self._lock:
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+            if sync and self.sync:
+                os.fsync(self._file.fileno())
+            self._apply(event)
+
+    def start_session(self, **info):
+        self._append({'event': 'session', **info})
+
+    def record(self, name, kind, sha256, size, **metadata):
+        # Returns False if the server already has this content
+        with self._lock:
+            entry = self.entries.get(sha256)
+        if entry is not None:
+            return entry['state'] != 'uploaded'
+        self._append({'event': 'artifact', 'name': name, 'kind': kind, 'sha256': sha256, 'size': size,
+                      **metadata}, sync=False)
+        return True
+
+    def record_file(self, path, kind, **metadata):
+        sha256 = file_hash(path)
+        self.record(os.path.basename(path), kind, sha256, os.path.getsize(path), **metadata)
+        return sha256
+
+    def adopt(self, prefix, kind, suffix=""):
+        # Journal files the journal never saw (written before it existed, or by a
+        # session that crashed first), using mtime as capture time. Returns their names.
+        with self._lock:
+            known = {entry['name'] for entry in self.entries.values()}
+        adopted = []
+        for name in sorted(os.listdir(self.folder)):
+            if name.startswith(prefix) and name.endswith(suffix) and name not in known:
+                path = os.path.join(self.folder, name)
+                self.record_file(path, kind, capture_time=os.path.getmtime(path), adopted=True)
+                adopted.append(name)
+        return adopted
+
+    def has_kind(self, kind):
+        with self._lock:
+            return any(entry['kind'] == kind for entry in self.entries.values())
+
+    def is_uploaded(self, sha256):
+        with self._lock:
+            entry = self.entries.get(sha256)
+            return entry is not None and entry['state'] == 'uploaded'
+
+    def mark_uploaded(self, sha256):
+        self._append({'event': 'uploaded', 'sha256': sha256})
+
+    def mark_failed(self, sha256, error=None):
+        self._append({'event': 'failed', 'sha256': sha256, 'error': str(error) if error else None})
+
+    def missing(self):
+        with self._lock:
+            return [dict(entry) for entry in self.entries.values() if entry['state'] != 'uploaded']
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def resume_uploads(journal, upload, workers=4, on_uploaded=None):
+    # Calls upload(entry, path) in parallel for every artifact the server does
+    # not have yet, then on_uploaded(entry, path) once that is journaled.
+    # Artifacts whose file is gone (never spilled) or no longer matches its
+    # hash cannot be recovered and are only counted.
+    results = {'uploaded': 0, 'failed': 0, 'unrecoverable': 0}
+    results_lock = threading.Lock()
+
+    def resume(entry):
+        path = os.path.join(journal.folder, entry['name'])
+        if not os.path.exists(path) or file_hash(path) != entry['sha256']:
+            outcome = 'unrecoverable'
+        else:
+            try:
+                upload(entry, path)
+                journal.mark_uploaded(entry['sha256'])
+                outcome = 'uploaded'
+                if on_uploaded:
+                    on_uploaded(entry, path)
+            except Exception as e:
+                print(f"Failed to upload {entry['name']}: {e}")
+                journal.mark_failed(entry['sha256'], e)
+                outcome = 'failed'
+        with results_lock:
+            results[outcome] += 1
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="resume-upload") as pool:
+        list(pool.map(resume, journal.missing()))
+    return results
@@ -0,0 +1,94 @@
+import collections
+import threading
+import time
+
+DROP_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+# Bounded upload queue drained by a fixed pool of worker threads, so capture
+# loops can hand off uploads without waiting on the network. When the queue is
+# full the drop policy decides what gives: 'block' applies backpressure to the
+# producer, 'drop_newest' rejects the new job, 'drop_oldest' evicts the stalest.
+# Evicted jobs are passed to `on_evict(fn, args, kwargs)` so their payload can
+# be saved elsewhere.
+class UploadQueue:
+    def __init__(self, workers=4, max_pending=32, drop_policy='drop_oldest', name="upload", on_evict=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {drop_policy!r}; expected one of {', '.join(DROP_POLICIES)}")
+        self.max_pending = max_pending
+        self.drop_policy = drop_policy
+        self.on_evict = on_evict
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._jobs = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self._workers = [threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def submit(self, fn, *args, **kwargs):
+        # Returns False if the job was not queued
+        evicted = None
+        with self._lock:
+            if self._closed:
+                return False
+            while len(self._jobs) >= self.max_pending:
+                if self.drop_policy == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                if self.drop_policy == 'drop_oldest':
+                    evicted = self._jobs.popleft()
+                    self.dropped += 1
+                    break
+                self._not_full.wait()
+                if self._closed:
+                    return False
+            self._jobs.append((fn, args, kwargs))
+            self.submitted += 1
+            self._not_empty.notify()
+        if evicted and self.on_evict:
+            self.on_evict(*evicted)
+        return True
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._jobs and not self._closed:
+                    self._not_empty.wait()
+                if not self._jobs:
+                    return
+                fn, args, kwargs = self._jobs.popleft()
+                self._not_full.notify()
+            try:
+                fn(*args, **kwargs)
+                with self._lock:
+                    self.completed += 1
+            except Exception as e:
+                print(f"Upload job {getattr(fn, '__name__', fn)} failed: {e}")
+                with self._lock:
+                    self.failed += 1
+
+    def close(self, timeout=None):
+        # Stops accepting jobs and waits for the pending ones to finish
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._jobs), 'submitted': self.submitted, 'completed': self.completed,
+                    'failed': self.failed, 'dropped': self.dropped}
+
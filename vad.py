@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+
+
+# Energy / zero-crossing voice-activity detector. Frames are classified in a
+# vectorized batch per block; `model` can replace the heuristic with any
+# callable taking a (n_frames, frame_samples) float array and returning a
+# boolean array.
+class EnergyVad:
+    def __init__(self, energy_threshold_db=-45.0, max_zero_crossing_rate=0.35):
+        self.energy_threshold_db = energy_threshold_db
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+
+    def __call__(self, frames):
+        energy_db = 10 * np.log10(np.mean(np.square(frames), axis=1) + 1e-10)
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        # High ZCR at low energy is hiss / fan noise rather than voice
+        return (energy_db > self.energy_threshold_db) & (
+            (zero_crossing_rate < self.max_zero_crossing_rate) | (energy_db > self.energy_threshold_db + 20))
+
+
+# Drops silent spans from the int16 mono chunk stream before it reaches the
+# sink/encoder/streamer. Short pauses are kept (hangover) so speech is not
+# clipped, and every kept span is recorded in a timestamp map of
+# (source_start, source_end, output_start) seconds so the server can map the
+# trimmed audio back onto the screenshot timeline.
+class VadGate:
+    def __init__(self, rate, frame_ms=30, hangover_ms=500, model=None):
+        self.rate = rate
+        self.channels = 1
+        self.sample_width = 2
+        self.frame_samples = rate * frame_ms // 1000
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.model = model or EnergyVad()
+        self.consumers = []
+        self.segments = []
+        self._remainder = b''
+        self._source_samples = 0
+        self._output_samples = 0
+        self._silent_run = self.hangover_frames
+
+    def add_consumer(self, consumer):
+        self.consumers.append(consumer)
+
+    def _keep(self, start, count):
+        # Extend the current segment if it is contiguous, otherwise open a new one
+        if self.segments and self.segments[-1][1] == start:
+            self.segments[-1][1] = start + count
+        else:
+            self.segments.append([start, start + count, self._output_samples])
+        self._output_samples += count
+
+    def feed(self, data):
+        frame_bytes = self.frame_samples * 2
+        data = self._remainder + data
+        usable = len(data) - len(data) % frame_bytes
+        self._remainder = data[usable:]
+        if not usable:
+            return
+        pcm = np.frombuffer(data[:usable], dtype='<i2')
+        frames = pcm.reshape(-1, self.frame_samples).astype(np.float32) / 32768.0
+        speech = np.asarray(self.model(frames), dtype=bool)
+        kept = []
+        for i, is_speech in enumerate(speech):
+            self._silent_run = 0 if is_speech else self._silent_run + 1
+            if self._silent_run <= self.hangover_frames:
+                kept.append(i)
+                self._keep(self._source_samples + i * self.frame_samples, self.frame_samples)
+        self._source_samples += len(speech) * self.frame_samples
+        if kept:
+            out = pcm.reshape(-1, self.frame_samples)[kept].tobytes()
+            for consumer in self.consumers:
+                consumer(out)
+
+    def flush(self):
+        # A trailing partial frame is too short to classify; it is dropped
+        self._remainder = b''
+
+    @property
+    def kept_ratio(self):
+        return self._output_samples / self._source_samples if self._source_samples else 1.0
+
+    def timestamp_map(self):
+        return [{'source_start': start / self.rate, 'source_end': end / self.rate,
+                 'output_start': output / self.rate} for start, end, output in self.segments]
+
+    def save_timestamp_map(self, path):
+        with open(path, 'w') as f:
+            json.dump({'rate': self.rate, 'source_duration': self._source_samples / self.rate,
+                       'output_duration': self._output_samples / self.rate,
+                       'segments': self.timestamp_map()}, f)
@@ -0,0 +1,68 @@
+import struct
+import threading
+import time
+
+WAV_HEADER_SIZE = 44
+
+
+# Incremental WAV writer. Chunks go straight to disk as they arrive and the RIFF
+# header is re-patched every `patch_interval` seconds (and on close), so memory
+# stays flat for any session length and a crash still leaves a playable file.
+class WavSink:
+    def __init__(self, path, channels, sample_width, rate, patch_interval=5.0):
+        self.path = path
+        self.channels = channels
+        self.sample_width = sample_width
+        self.rate = rate
+        self.patch_interval = patch_interval
+        self.data_bytes = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(self._header(0))
+        self._file.flush()
+        self._last_patch = time.monotonic()
+
+    def _header(self, data_bytes):
+        block_align = self.channels * self.sample_width
+        return struct.pack(
+            '<4sI4s4sIHHIIHH4sI',
+            b'RIFF', 36 + data_bytes, b'WAVE',
+            b'fmt ', 16, 1, self.channels, self.rate,
+            self.rate * block_align, block_align, self.sample_width * 8,
+            b'data', data_bytes,
+        )
+
+    def _patch_header(self):
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(self._header(self.data_bytes))
+        self._file.seek(position)
+        self._file.flush()
+        self._last_patch = time.monotonic()
+
+    def write(self, data):
+        with self._lock:
+            if self._file is None:
+                raise ValueError(f"WAV sink {self.path} is closed")
+            self._file.write(data)
+            self.data_bytes += len(data)
+            if time.monotonic() - self._last_patch >= self.patch_interval:
+                self._patch_header()
+
+    @property
+    def duration(self):
+        return self.data_bytes / (self.rate * self.channels * self.sample_width)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._patch_header()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()